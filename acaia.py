@@ -1,7 +1,7 @@
 import asyncio
 import logging
 import sys
-from bleak import BleakScanner
+from ble_discovery import discover
 from pyacaia_async import AcaiaScale
 
 # Configure logging to be minimal by default
@@ -10,18 +10,9 @@ logger = logging.getLogger("acaia_cli")
 
 async def scan_for_pearls():
     """Scan for BLE devices with 'PEARL' in their name."""
-    print("Scanning for Acaia Pearl scales (5 seconds)...")
-    devices = await BleakScanner.discover(return_adv=True, timeout=5.0)
-    
-    candidates = []
-    for d, a in devices.values():
-        name = d.name or ""
-        if "PEARL" in name.upper():
-            candidates.append((d, a))
-    
-    # Sort by RSSI (signal strength)
-    candidates.sort(key=lambda x: x[1].rssi, reverse=True)
-    return candidates
+    print("Scanning for Acaia Pearl scales (up to 5 seconds)...")
+    # Returns (sorted by RSSI) as soon as no new scales appear
+    return await discover(name_contains=("PEARL",), timeout=5.0)
 
 async def async_input(prompt: str) -> str:
     """Async wrapper for input() to avoid blocking the event loop."""
@@ -82,8 +73,7 @@ async def main():
         print("No Acaia Pearl scales found.")
         choice = await async_input("Show all detected BLE devices? (y/n): ")
         if choice.lower().startswith('y'):
-             devices = await BleakScanner.discover(return_adv=True, timeout=3.0)
-             all_devices = sorted([(d, a) for d, a in devices.values()], key=lambda x: x[1].rssi, reverse=True)
+             all_devices = await discover(timeout=3.0, settle=None)
              print("\nAll detected devices:")
              for i, (d, a) in enumerate(all_devices):
                  name = d.name or "Unknown"
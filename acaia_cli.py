@@ -1,22 +1,19 @@
 import asyncio
 import logging
 from aioacaia import AcaiaScale
-from bleak import BleakScanner
+from ble_discovery import discover
 
 # Set logging to see aioacaia debug info if needed
 # logging.basicConfig(level=logging.DEBUG)
 
 async def main():
     print("Scanning for Acaia scales (via Bleak)...")
-    devices = await BleakScanner.discover()
+    # Stops scanning as soon as the first scale advertises
+    found = await discover(name_contains=["ACAIA", "PEARL", "LUNAR", "PYXIS"], limit=1)
     
-    target_device = None
-    for d in devices:
-        name = d.name or ""
-        if any(x in name.upper() for x in ["ACAIA", "PEARL", "LUNAR", "PYXIS"]):
-            print(f"Found: {name} ({d.address})")
-            target_device = d
-            break 
+    target_device = found[0][0] if found else None
+    if target_device:
+        print(f"Found: {target_device.name} ({target_device.address})")
             
     if not target_device:
         print("No Acaia scale found.")
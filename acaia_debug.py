@@ -1,7 +1,7 @@
 import asyncio
 import logging
 import sys
-from bleak import BleakScanner
+from ble_discovery import discover
 from pyacaia_async import AcaiaScale
 
 # Set logging to DEBUG to see raw packets
@@ -16,8 +16,8 @@ async def main():
     print("--- Acaia Python Debugger ---")
     print("Scanning for Acaia scales...")
     
-    devices = await BleakScanner.discover(timeout=5.0)
-    acaia_devices = [d for d in devices if d.name and ("ACAIA" in d.name.upper() or "PEARL" in d.name.upper() or "LUNAR" in d.name.upper())]
+    found = await discover(name_contains=("ACAIA", "PEARL", "LUNAR"), timeout=5.0)
+    acaia_devices = [d for d, _ in found]
     
     if not acaia_devices:
         print("No Acaia scales found. Make sure it's turned on and not connected to another device.")
@@ -1,16 +1,17 @@
 import asyncio
 import logging
 import sys
-from bleak import BleakScanner
+from ble_discovery import discover
 from pyacaia_async import AcaiaScale
 
 logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 
 async def main():
     print("--- Acaia Advanced Debugger ---")
-    devices = await BleakScanner.discover(timeout=5.0)
-    print([d.name for d in devices])
-    acaia_devices = [d for d in devices if d.name and "PEARL" in d.name.upper()]
+    # List everything in range for diagnosis, so no filter and no early exit
+    found = await discover(timeout=5.0, settle=None)
+    print([d.name for d, _ in found])
+    acaia_devices = [d for d, _ in found if d.name and "PEARL" in d.name.upper()]
     
     if not acaia_devices:
         print("No Acaia scales found.")
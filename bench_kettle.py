@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+End-to-end latency benchmark for the kettle HTTP APIs.
+
+Drives kettle_server.app and server.app in-process (through httpx's ASGI
+transport) against a simulated BLE link from kettle_sim, and reports
+p50/p95/p99 latency, throughput and, for kettle_server, the time requests
+spent queued in the kettle schedulers.
+
+    python bench_kettle.py --concurrency 8 --requests 200 --out bench.json
+    python bench_kettle.py --kettles 3 --scenarios smarthome_query smarthome_execute
+    python bench_kettle.py --baseline bench.json   # compare against an earlier run
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Optional
+
+import httpx
+
+from ble_scheduler import OperationScheduler, Priority
+from kettle_sim import KettleSimulator, LinkProfile
+
+def _kettle(index: int) -> tuple[str, str]:
+    """Simulated (name, address) of the index-th kettle; the first is the default kettle."""
+    return f"EKG-a8-41-f{index}", f"A8:41:F0:00:00:{index + 1:02X}"
+TOKEN = "bench-access-token"
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+def _summary(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(1000 * sum(ordered) / len(ordered), 3) if ordered else 0.0,
+        "p50_ms": round(1000 * _percentile(ordered, 50), 3),
+        "p95_ms": round(1000 * _percentile(ordered, 95), 3),
+        "p99_ms": round(1000 * _percentile(ordered, 99), 3),
+        "max_ms": round(1000 * ordered[-1], 3) if ordered else 0.0,
+    }
+
+class TimedScheduler(OperationScheduler):
+    """OperationScheduler that keeps every wait time, not just recent ones."""
+
+    def __init__(self):
+        super().__init__()
+        self.waits: list[float] = []
+
+    def _granted(self, priority: Priority, waited: float):
+        super()._granted(priority, waited)
+        self.waits.append(waited)
+
+# ========== Scenarios ==========
+
+def _smarthome(intent: str, payload: Optional[dict] = None) -> dict:
+    body = {"requestId": "bench", "inputs": [{"intent": intent}]}
+    if payload is not None:
+        body["inputs"][0]["payload"] = payload
+    return body
+
+def _kettle_server_scenarios(device_ids: list[str]) -> dict:
+    """name -> (method, path, json body); the Smart Home intents address every kettle."""
+    execute = {
+        "commands": [{
+            "devices": [{"id": device_id} for device_id in device_ids],
+            "execution": [
+                {"command": "action.devices.commands.SetTemperature", "params": {"temperature": 93}},
+                {"command": "action.devices.commands.OnOff", "params": {"on": True}},
+            ],
+        }]
+    }
+    return {
+        "state": ("GET", "/api/state", None),
+        "temperature": ("POST", "/api/temperature", {"temperature": 92}),
+        "schedule": ("POST", "/api/schedule", {"mode": "daily", "hour": 7, "minute": 30, "temperature": 93}),
+        "smarthome_sync": ("POST", "/smarthome", _smarthome("action.devices.SYNC")),
+        "smarthome_query": ("POST", "/smarthome", _smarthome("action.devices.QUERY")),
+        "smarthome_execute": ("POST", "/smarthome", _smarthome("action.devices.EXECUTE", execute)),
+    }
+
+SERVER_SCENARIOS = {
+    "state": ("GET", "/api/state", None),
+    "temperature": ("POST", "/api/temperature", {"temperature": 92}),
+    "schedule": ("POST", "/api/schedule", {"mode": "daily", "hour": 7, "minute": 30, "temperature": 93}),
+}
+
+async def _run_scenario(client: httpx.AsyncClient, request: tuple, total: int, concurrency: int) -> dict:
+    method, path, body = request
+    latencies: list[float] = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    result = _summary(latencies)
+    result["errors"] = errors
+    result["throughput_rps"] = round(len(latencies) / elapsed, 3) if elapsed else 0.0
+    return result
+
+async def bench_kettle_server(sim: KettleSimulator, args) -> dict:
+    import kettle_server
+    from ble_registry import ScannerService
+
+    await kettle_server.db.store_tokens(TOKEN, "bench-refresh-token", "bench", 3600)
+    kettle_server.scanner_service = ScannerService(scanner=sim.scanner)
+    pool = kettle_server.KettlePool.from_names(
+        [_kettle(i)[0] for i in range(args.kettles)],
+        scanner=sim.scanner, client_factory=sim.client,
+        scanner_service=kettle_server.scanner_service,
+    )
+    schedulers = []
+    for manager in pool.managers.values():
+        manager.scheduler = TimedScheduler()
+        schedulers.append(manager.scheduler)
+    kettle_server.kettle_pool = pool
+
+    results = {}
+    headers = {"Authorization": f"Bearer {TOKEN}"}
+    transport = httpx.ASGITransport(app=kettle_server.app)
+    async with kettle_server.app.router.lifespan_context(kettle_server.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as client:
+            for _ in range(args.warmup):
+                await client.get("/api/state")
+            for name, request in _kettle_server_scenarios(list(pool.ids())).items():
+                if args.scenarios and name not in args.scenarios:
+                    continue
+                for scheduler in schedulers:
+                    scheduler.waits.clear()
+                result = await _run_scenario(client, request, args.requests, args.concurrency)
+                waits = [wait for scheduler in schedulers for wait in scheduler.waits]
+                result["queue_wait"] = _summary(waits)
+                result["queue_wait"]["total_s"] = round(sum(waits), 3)
+                results[f"kettle_server {name}"] = result
+    return results
+
+async def bench_server(sim: KettleSimulator, args) -> dict:
+    import server
+    from ble_registry import ScannerService
+    from stagg_ekg_pro import StaggEKGPro
+    from state_reconciler import StateReconciler
+
+    server.scanner_service = ScannerService(scanner=sim.scanner)
+    results = {}
+    transport = httpx.ASGITransport(app=server.app)
+    async with server.app.router.lifespan_context(server.app):
+        # Equivalent of POST /api/connect, but over the simulated link
+        server.kettle = StaggEKGPro(_kettle(0)[1], client_factory=sim.client)
+        await server.kettle.connect()
+        server.reconciler = StateReconciler.for_kettle(server.kettle)
+        server.reconciler.start()
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for _ in range(args.warmup):
+                await client.get("/api/state")
+            for name, request in SERVER_SCENARIOS.items():
+                if args.scenarios and name not in args.scenarios:
+                    continue
+                results[f"server {name}"] = await _run_scenario(client, request, args.requests, args.concurrency)
+    return results
+
+# ========== Reporting ==========
+
+def _print_results(results: dict, baseline: Optional[dict]):
+    base = (baseline or {}).get("results", {})
+    print(f"{'scenario':<32}{'p50':>10}{'p95':>10}{'p99':>10}{'rps':>10}{'queue p95':>10}{'errors':>8}")
+    for name, r in results.items():
+        queue = r.get("queue_wait", {}).get("p95_ms", "")
+        print(f"{name:<32}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['throughput_rps']:>10}{queue:>10}{r['errors']:>8}")
+        if name in base:
+            deltas = []
+            for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+                old = base[name].get(key)
+                if old:
+                    deltas.append(f"{key} {100 * (r[key] - old) / old:+.1f}%")
+            print(f"{'':<32}vs baseline: {', '.join(deltas)}")
+
+async def main(args):
+    profile = LinkProfile(
+        connect_latency=args.connect_latency,
+        read_latency=args.read_latency,
+        write_latency=args.write_latency,
+        notify_latency=args.notify_latency,
+        scan_latency=args.scan_latency,
+        jitter=args.jitter,
+        drop_rate=args.drop_rate,
+        seed=args.seed,
+    )
+    sim = KettleSimulator(profile)
+    for i in range(args.kettles):
+        sim.add_kettle(*_kettle(i))
+
+    results = {}
+    async with sim:
+        if args.target in ("kettle_server", "all"):
+            results.update(await bench_kettle_server(sim, args))
+        if args.target in ("server", "all"):
+            results.update(await bench_server(sim, args))
+
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "target": args.target,
+            "concurrency": args.concurrency,
+            "kettles": args.kettles,
+            "requests": args.requests,
+            "profile": vars(profile),
+            "ble_stats": sim.stats,
+        },
+        "results": results,
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    _print_results(results, baseline)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.out}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the kettle HTTP APIs against a simulated kettle.")
+    parser.add_argument("--target", choices=["kettle_server", "server", "all"], default="all")
+    parser.add_argument("--scenarios", nargs="*", help="Only run these scenarios (e.g. state smarthome_query)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--kettles", type=int, default=1, help="Simulated kettles served by kettle_server")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured requests before the scenarios")
+    parser.add_argument("--connect-latency", type=float, default=1.5)
+    parser.add_argument("--read-latency", type=float, default=0.06)
+    parser.add_argument("--write-latency", type=float, default=0.06)
+    parser.add_argument("--notify-latency", type=float, default=0.03)
+    parser.add_argument("--scan-latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--out", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against results from an earlier run")
+    args = parser.parse_args()
+
+    for path in ("out", "baseline"):
+        if getattr(args, path):
+            setattr(args, path, os.path.abspath(getattr(args, path)))
+
+    # The servers resolve templates/ and static/ relative to the working directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.getcwd())
+    os.environ.setdefault("KETTLE_DB_PATH", os.path.join(tempfile.mkdtemp(), "bench_oauth.db"))
+
+    asyncio.run(main(args))
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+BLE traffic capture and deterministic replay.
+
+RecordingClient wraps a BleakClient and appends every connect, read, write
+and notification to a compact binary log. ReplayClient plays such a log back
+in place of a BleakClient, so StaggEKGPro (and the servers built on it) can
+be benchmarked and regression-tested on machines without a radio:
+
+    log = CaptureLog("session.blecap")
+    kettle = StaggEKGPro(address, client_factory=recording_client_factory(log))
+
+    replay = CaptureReplay.load("session.blecap", realtime=False)
+    kettle = StaggEKGPro(address, client_factory=replay.client)
+
+Log format: an 8-byte magic header followed by records of
+``<float64 t><uint8 kind><uint8 char><uint16 len>`` and ``len`` data bytes,
+where ``t`` is monotonic seconds since the capture started and ``char``
+indexes a characteristic UUID declared earlier by a CHAR record.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import struct
+import time
+from enum import IntEnum
+from typing import Callable, NamedTuple, Optional
+
+from bleak import BleakClient, BleakError
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"BLECAP\x01\n"
+_RECORD = struct.Struct("<dBBH")
+
+class EventKind(IntEnum):
+    """Record types in a capture log"""
+    CHAR = 0          # Declares the UUID for a characteristic index
+    CONNECT = 1       # data: address
+    DISCONNECT = 2    # data: b"\x01" if the link was lost, empty if requested
+    READ = 3
+    WRITE = 4
+    NOTIFY = 5
+    START_NOTIFY = 6
+    STOP_NOTIFY = 7
+
+class CaptureEvent(NamedTuple):
+    t: float
+    kind: EventKind
+    char: Optional[str]
+    data: bytes
+
+class ReplayMismatch(BleakError):
+    """The client under replay diverged from the captured session."""
+
+def _char_key(char) -> str:
+    """Normalize a characteristic (UUID string, handle or object) to a string key."""
+    uuid = getattr(char, "uuid", char)
+    return str(uuid).lower()
+
+# ========== Capture ==========
+
+class CaptureLog:
+    """Append-only binary log of BLE events."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._chars: dict[str, int] = {}
+        last_t = 0.0
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not is_new:
+            # Carry on from the existing log: same characteristic indexes, and
+            # timestamps that keep increasing instead of restarting at zero
+            with open(path, "rb") as f:
+                blob = f.read()
+            if not blob.startswith(MAGIC):
+                raise ValueError(f"{path} is not a BLE capture log.")
+            for t, kind, index, data in _records(blob):
+                last_t = t
+                if kind == EventKind.CHAR:
+                    self._chars[data.decode()] = index
+        self._file = open(path, "ab")
+        if is_new:
+            self._file.write(MAGIC)
+        self._t0 = time.monotonic() - last_t
+
+    def record(self, kind: EventKind, char=None, data: bytes = b""):
+        """Append an event, timestamped relative to when the log was started."""
+        index = 0
+        if char is not None:
+            key = _char_key(char)
+            index = self._chars.get(key)
+            if index is None:
+                index = len(self._chars) + 1
+                if index > 0xFF:
+                    raise ValueError("Too many characteristics in one capture.")
+                self._chars[key] = index
+                self._write(EventKind.CHAR, index, key.encode())
+        self._write(kind, index, bytes(data))
+
+    def _write(self, kind: EventKind, index: int, data: bytes):
+        self._file.write(_RECORD.pack(time.monotonic() - self._t0, kind, index, len(data)))
+        self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+def read_capture(path: str) -> list[CaptureEvent]:
+    """Read all events from a capture log."""
+    with open(path, "rb") as f:
+        blob = f.read()
+    if not blob.startswith(MAGIC):
+        raise ValueError(f"{path} is not a BLE capture log.")
+
+    chars: dict[int, str] = {}
+    events = []
+    for t, kind, index, data in _records(blob):
+        if kind == EventKind.CHAR:
+            chars[index] = data.decode()
+            continue
+        events.append(CaptureEvent(t, EventKind(kind), chars.get(index), data))
+    return events
+
+def _records(blob: bytes):
+    """Yield (t, kind, index, data) for each record after the magic header."""
+    offset = len(MAGIC)
+    while offset + _RECORD.size <= len(blob):
+        t, kind, index, length = _RECORD.unpack_from(blob, offset)
+        offset += _RECORD.size
+        yield t, kind, index, blob[offset:offset + length]
+        offset += length
+
+class RecordingClient:
+    """A BleakClient wrapper that logs all traffic to a CaptureLog."""
+
+    def __init__(self, client: BleakClient, log: CaptureLog):
+        self._client = client
+        self._log = log
+        self._disconnecting = False
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    @property
+    def address(self) -> str:
+        return self._client.address
+
+    @property
+    def is_connected(self) -> bool:
+        return self._client.is_connected
+
+    def _on_disconnect(self, client):
+        if self._disconnecting:
+            return  # Requested disconnects are logged in disconnect()
+        self._log.record(EventKind.DISCONNECT, data=b"\x01")
+        self._log.flush()
+
+    async def connect(self, **kwargs):
+        self._disconnecting = False
+        result = await self._client.connect(**kwargs)
+        self._log.record(EventKind.CONNECT, data=self._client.address.encode())
+        self._log.flush()
+        return result
+
+    async def disconnect(self):
+        self._log.record(EventKind.DISCONNECT)
+        self._log.flush()
+        self._disconnecting = True
+        try:
+            return await self._client.disconnect()
+        finally:
+            self._disconnecting = False
+
+    async def read_gatt_char(self, char, **kwargs):
+        data = await self._client.read_gatt_char(char, **kwargs)
+        self._log.record(EventKind.READ, char, data)
+        return data
+
+    async def write_gatt_char(self, char, data, response=None):
+        await self._client.write_gatt_char(char, data, response=response)
+        self._log.record(EventKind.WRITE, char, data)
+
+    async def start_notify(self, char, callback: Callable, **kwargs):
+        def _record(sender, data):
+            self._log.record(EventKind.NOTIFY, char, data)
+            return callback(sender, data)
+
+        await self._client.start_notify(char, _record, **kwargs)
+        self._log.record(EventKind.START_NOTIFY, char)
+
+    async def stop_notify(self, char):
+        await self._client.stop_notify(char)
+        self._log.record(EventKind.STOP_NOTIFY, char)
+
+def recording_client_factory(log: CaptureLog, client_factory: Callable[..., BleakClient] = BleakClient):
+    """Return a client factory for StaggEKGPro that records into ``log``."""
+    def factory(address, **kwargs):
+        recorder = None
+        user_callback = kwargs.pop("disconnected_callback", None)
+
+        def on_disconnect(client):
+            recorder._on_disconnect(client)
+            if user_callback:
+                user_callback(client)
+
+        recorder = RecordingClient(client_factory(address, disconnected_callback=on_disconnect, **kwargs), log)
+        return recorder
+    return factory
+
+# ========== Replay ==========
+
+class CaptureReplay:
+    """
+    A loaded capture, shared by the ReplayClients created from it so that a
+    reconnect continues where the previous session stopped.
+
+    Args:
+        events: Events as returned by read_capture().
+        realtime: Reproduce the captured timing instead of replaying as fast
+            as possible.
+        speed: Playback speed multiplier in realtime mode.
+        strict: Require the client to issue exactly the captured reads and
+            writes, in order. When False, reads and writes are matched to the
+            next captured event of the same kind, and calls with no captured
+            counterpart are answered from the last known value.
+    """
+
+    def __init__(self, events: list[CaptureEvent], realtime: bool = False,
+                 speed: float = 1.0, strict: bool = True):
+        self.events = events
+        self.realtime = realtime
+        self.speed = speed
+        self.strict = strict
+        self.cursor = 0
+        self._clock_origin: Optional[float] = None
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "CaptureReplay":
+        return cls(read_capture(path), **kwargs)
+
+    def client(self, address: str, disconnected_callback: Optional[Callable] = None, **kwargs) -> "ReplayClient":
+        """Client factory for StaggEKGPro."""
+        return ReplayClient(self, address, disconnected_callback)
+
+    @property
+    def finished(self) -> bool:
+        return self.cursor >= len(self.events)
+
+    async def _wait_until(self, event: CaptureEvent):
+        if not self.realtime:
+            return
+        loop = asyncio.get_running_loop()
+        if self._clock_origin is None:
+            self._clock_origin = loop.time() - event.t / self.speed
+        delay = self._clock_origin + event.t / self.speed - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class ReplayClient:
+    """Stands in for a BleakClient, answering from a CaptureReplay."""
+
+    def __init__(self, replay: CaptureReplay, address: str, disconnected_callback: Optional[Callable] = None):
+        self._replay = replay
+        self.address = address
+        self._disconnected_callback = disconnected_callback
+        self._connected = False
+        self._callbacks: dict[str, Callable] = {}
+        self._last_values: dict[str, bytes] = {}
+        self._lock = asyncio.Lock()
+        self._pump_task: Optional[asyncio.Task] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def _deliver(self, event: CaptureEvent):
+        """Play back a notification or link loss."""
+        await self._replay._wait_until(event)
+        self._replay.cursor += 1
+        if event.kind == EventKind.NOTIFY:
+            self._last_values[event.char] = event.data
+            callback = self._callbacks.get(event.char)
+            if callback:
+                callback(event.char, bytearray(event.data))
+        elif event.kind == EventKind.DISCONNECT and event.data:
+            self._connected = False
+            if self._disconnected_callback:
+                self._disconnected_callback(self)
+
+    def _is_passive(self, event: CaptureEvent) -> bool:
+        return event.kind == EventKind.NOTIFY or (event.kind == EventKind.DISCONNECT and bool(event.data))
+
+    async def _advance(self, kind: EventKind, char=None) -> Optional[CaptureEvent]:
+        """Play back events up to and including the next one of ``kind``."""
+        key = _char_key(char) if char is not None else None
+        replay = self._replay
+        while not replay.finished:
+            event = replay.events[replay.cursor]
+            if self._is_passive(event):
+                await self._deliver(event)
+                continue
+            if event.kind == kind and (key is None or event.char == key):
+                await replay._wait_until(event)
+                replay.cursor += 1
+                return event
+            if replay.strict:
+                raise ReplayMismatch(f"Expected {event.kind.name} on {event.char}, got {kind.name} on {key}")
+            # Skip this unexpected event if a matching call comes later;
+            # if none does, leave the cursor where it is
+            for ahead in range(replay.cursor + 1, len(replay.events)):
+                candidate = replay.events[ahead]
+                if candidate.kind == kind and (key is None or candidate.char == key):
+                    replay.cursor += 1
+                    break
+            else:
+                return None
+        if replay.strict:
+            raise ReplayMismatch(f"Capture exhausted before {kind.name} on {key}")
+        return None
+
+    async def _pump(self):
+        """Deliver notifications captured between this call and the next one."""
+        async with self._lock:
+            replay = self._replay
+            while not replay.finished and self._is_passive(replay.events[replay.cursor]):
+                await self._deliver(replay.events[replay.cursor])
+
+    def _schedule_pump(self):
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.get_running_loop().create_task(self._pump())
+
+    async def _call(self, kind: EventKind, char=None) -> Optional[CaptureEvent]:
+        async with self._lock:
+            if kind != EventKind.CONNECT and not self._connected:
+                raise BleakError("Not connected")
+            event = await self._advance(kind, char)
+        self._schedule_pump()
+        return event
+
+    async def connect(self, **kwargs) -> bool:
+        await self._call(EventKind.CONNECT)
+        self._connected = True
+        return True
+
+    async def disconnect(self) -> bool:
+        if self._connected:
+            await self._call(EventKind.DISCONNECT)
+        self._connected = False
+        return True
+
+    async def read_gatt_char(self, char, **kwargs) -> bytearray:
+        event = await self._call(EventKind.READ, char)
+        if event is not None:
+            self._last_values[event.char] = event.data
+            return bytearray(event.data)
+        return bytearray(self._last_values.get(_char_key(char), b""))
+
+    async def write_gatt_char(self, char, data, response=None):
+        event = await self._call(EventKind.WRITE, char)
+        if event is not None and self._replay.strict and event.data != bytes(data):
+            raise ReplayMismatch(f"Write {bytes(data).hex()} differs from captured {event.data.hex()}")
+        self._last_values[_char_key(char)] = bytes(data)
+
+    async def start_notify(self, char, callback: Callable, **kwargs):
+        self._callbacks[_char_key(char)] = callback
+        await self._call(EventKind.START_NOTIFY, char)
+
+    async def stop_notify(self, char):
+        self._callbacks.pop(_char_key(char), None)
+        await self._call(EventKind.STOP_NOTIFY, char)
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the events in a BLE capture log.")
+    parser.add_argument("path", help="Capture log to read")
+    args = parser.parse_args()
+
+    for event in read_capture(args.path):
+        char = f" {event.char}" if event.char else ""
+        print(f"{event.t:10.4f} {event.kind.name:<12}{char} {event.data.hex()}")
+
+if __name__ == "__main__":
+    main()
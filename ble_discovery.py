@@ -0,0 +1,101 @@
+"""
+Targeted, early-terminating BLE discovery for the command-line tools.
+
+Instead of always waiting out a fixed BleakScanner.discover() timeout,
+discover() returns as soon as the set of matching devices stops growing,
+and stream_devices() yields candidates the moment they are first seen:
+
+    devices = await discover(name_contains=("EKG",))          # [(device, adv), ...]
+    async for device, adv in stream_devices(name_contains=("PEARL",)):
+        print(device.name)
+"""
+
+import asyncio
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Iterable, Optional
+
+from bleak import BleakScanner
+
+class DiscoveryFilter:
+    """
+    Predicate over advertisements. A device matches if its name contains any
+    of ``name_contains`` (case-insensitive), it advertises any of
+    ``service_uuids``, and its RSSI is at least ``min_rssi``; empty criteria
+    are ignored.
+    """
+
+    def __init__(self, name_contains: Iterable[str] = (), service_uuids: Iterable[str] = (),
+                 min_rssi: Optional[int] = None):
+        self.name_contains = tuple(n.upper() for n in name_contains)
+        self.service_uuids = tuple(u.lower() for u in service_uuids)
+        self.min_rssi = min_rssi
+
+    def __call__(self, device, adv) -> bool:
+        if self.name_contains:
+            name = (adv.local_name or device.name or "").upper()
+            if not any(n in name for n in self.name_contains):
+                return False
+        if self.service_uuids:
+            advertised = {u.lower() for u in adv.service_uuids or ()}
+            if not advertised.intersection(self.service_uuids):
+                return False
+        if self.min_rssi is not None and adv.rssi < self.min_rssi:
+            return False
+        return True
+
+async def stream_devices(name_contains: Iterable[str] = (), service_uuids: Iterable[str] = (),
+                         min_rssi: Optional[int] = None, timeout: float = 5.0,
+                         settle: Optional[float] = None, scanner=BleakScanner) -> AsyncIterator[tuple]:
+    """
+    Yield ``(device, advertisement)`` for each matching device as it is first seen.
+
+    Stops after ``timeout`` seconds, or, with ``settle``, once at least one
+    device has matched and no new one has appeared for ``settle`` seconds.
+    """
+    matches = DiscoveryFilter(name_contains, service_uuids, min_rssi)
+    queue: asyncio.Queue = asyncio.Queue()
+    seen: set[str] = set()
+
+    def on_advertisement(device, adv):
+        if device.address not in seen and matches(device, adv):
+            seen.add(device.address)
+            queue.put_nowait((device, adv))
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    scan_kwargs = {"service_uuids": list(matches.service_uuids)} if matches.service_uuids else {}
+    async with scanner(detection_callback=on_advertisement, **scan_kwargs):
+        while True:
+            wait = deadline - loop.time()
+            if settle is not None and seen:
+                wait = min(wait, settle)
+            if wait <= 0:
+                return
+            try:
+                yield await asyncio.wait_for(queue.get(), wait)
+            except asyncio.TimeoutError:
+                return
+
+async def discover(name_contains: Iterable[str] = (), service_uuids: Iterable[str] = (),
+                   min_rssi: Optional[int] = None, timeout: float = 5.0, settle: Optional[float] = 0.5,
+                   limit: Optional[int] = None, on_candidate: Optional[Callable] = None,
+                   scanner=BleakScanner) -> list[tuple]:
+    """
+    Scan for matching devices, returning ``[(device, advertisement), ...]``
+    strongest signal first.
+
+    Returns once the match set has been stable for ``settle`` seconds (pass
+    None to scan for the full ``timeout``), or as soon as ``limit`` devices
+    have matched. ``on_candidate(device, adv)`` is called for each match as
+    it arrives.
+    """
+    found = []
+    async with aclosing(stream_devices(name_contains, service_uuids, min_rssi, timeout, settle, scanner)) as stream:
+        async for device, adv in stream:
+            found.append((device, adv))
+            if on_candidate:
+                on_candidate(device, adv)
+            if limit is not None and len(found) >= limit:
+                break
+    found.sort(key=lambda x: x[1].rssi, reverse=True)
+    return found
@@ -0,0 +1,265 @@
+"""
+Shared long-lived BLE scanner and device registry.
+
+ScannerService keeps one BleakScanner running and feeds every advertisement
+into a DeviceRegistry, so scans and device lookups are answered instantly
+from what has already been seen instead of each caller running its own
+multi-second BleakScanner.discover():
+
+    service = ScannerService()
+    await service.start()
+    kettles = service.registry.find(name_contains=("EKG", "Stagg"))
+    entry = await service.registry.wait_for("EKG-a8-41-f0", timeout=10.0)
+"""
+
+import asyncio
+import bisect
+import logging
+import sys
+import time
+from typing import Callable, Iterable, Optional, Union
+
+from bleak import BleakScanner
+
+logger = logging.getLogger(__name__)
+
+class DeviceEntry:
+    """What the registry knows about one advertising device."""
+    __slots__ = ('address', 'name', 'rssi', 'last_rssi', 'first_seen', 'last_seen', 'service_uuids', 'device')
+
+    def __init__(self, address: str, name: Optional[str], rssi: int, now: float, service_uuids, device):
+        self.address = address
+        self.name = name
+        self.rssi = float(rssi)
+        self.last_rssi = rssi
+        self.first_seen = now
+        self.last_seen = now
+        self.service_uuids = list(service_uuids or [])
+        self.device = device
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "address": self.address,
+            "rssi": round(self.rssi),
+            "last_seen": self.last_seen,
+        }
+
+    def __repr__(self):
+        return f"DeviceEntry({self.name!r}, {self.address}, rssi={self.rssi:.1f})"
+
+Match = Union[str, Callable[[DeviceEntry], bool]]
+
+class DeviceRegistry:
+    """
+    Devices seen by a scanner, indexed by address and by name.
+
+    Args:
+        rssi_alpha: EWMA weight of the newest RSSI reading.
+        max_age: Seconds after which a device that stopped advertising is
+            no longer returned by lookups.
+        evict_after: Seconds after which such a device is forgotten
+            altogether (five times ``max_age`` by default), so devices
+            advertising from rotating random addresses don't pile up.
+    """
+
+    def __init__(self, rssi_alpha: float = 0.3, max_age: float = 60.0,
+                 evict_after: Optional[float] = None):
+        self.rssi_alpha = rssi_alpha
+        self.max_age = max_age
+        self.evict_after = evict_after if evict_after is not None else 5 * max_age
+        self._next_prune = 0.0
+        self._by_address: dict[str, DeviceEntry] = {}
+        self._names: list[tuple[str, str]] = []  # Sorted (name, address) pairs for prefix lookups
+        self._waiters: list[tuple[Callable[[DeviceEntry], bool], asyncio.Future]] = []
+
+    def observe(self, device, adv, now: Optional[float] = None) -> DeviceEntry:
+        """Record an advertisement (the signature of a BleakScanner detection callback)."""
+        now = time.time() if now is None else now
+        name = adv.local_name or device.name
+        entry = self._by_address.get(device.address)
+        if entry is None:
+            entry = DeviceEntry(device.address, name, adv.rssi, now, adv.service_uuids, device)
+            self._by_address[device.address] = entry
+            if name:
+                bisect.insort(self._names, (name, device.address))
+        else:
+            if name and name != entry.name:
+                if entry.name:
+                    self._names.remove((entry.name, entry.address))
+                bisect.insort(self._names, (name, device.address))
+                entry.name = name
+            entry.rssi = self.rssi_alpha * adv.rssi + (1 - self.rssi_alpha) * entry.rssi
+            entry.last_rssi = adv.rssi
+            entry.last_seen = now
+            entry.device = device
+            if adv.service_uuids:
+                entry.service_uuids = list(adv.service_uuids)
+
+        if now >= self._next_prune:
+            self.prune(now)
+        if self._waiters:
+            self._notify_waiters(entry)
+        return entry
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Forget devices not seen for ``evict_after`` seconds. Returns how many."""
+        now = time.time() if now is None else now
+        # observe() prunes at most this often, so the sweep stays off the per-advertisement path
+        self._next_prune = now + self.evict_after / 5
+        stale = {address for address, entry in self._by_address.items()
+                 if now - entry.last_seen > self.evict_after}
+        if stale:
+            for address in stale:
+                del self._by_address[address]
+            self._names = [pair for pair in self._names if pair[1] not in stale]
+        return len(stale)
+
+    def _notify_waiters(self, entry: DeviceEntry):
+        remaining = []
+        for match, future in self._waiters:
+            if future.done():
+                continue
+            if match(entry):
+                future.set_result(entry)
+            else:
+                remaining.append((match, future))
+        self._waiters = remaining
+
+    def _fresh(self, entry: DeviceEntry, max_age: Optional[float], now: float) -> bool:
+        max_age = self.max_age if max_age is None else max_age
+        return now - entry.last_seen <= max_age
+
+    def get(self, address: str, max_age: Optional[float] = None) -> Optional[DeviceEntry]:
+        entry = self._by_address.get(address)
+        if entry and self._fresh(entry, max_age, time.time()):
+            return entry
+        return None
+
+    def find(self, name_prefix: str = "", name_contains: Iterable[str] = (),
+             min_rssi: Optional[float] = None, max_age: Optional[float] = None) -> list[DeviceEntry]:
+        """
+        Return fresh devices matching all given filters, strongest signal first.
+        ``name_prefix`` uses the sorted name index; ``name_contains`` matches
+        devices whose name contains any of the given substrings.
+        """
+        now = time.time()
+        if name_prefix:
+            start = bisect.bisect_left(self._names, (name_prefix, ""))
+            candidates = []
+            for name, address in self._names[start:]:
+                if not name.startswith(name_prefix):
+                    break
+                candidates.append(self._by_address[address])
+        else:
+            candidates = self._by_address.values()
+
+        needles = tuple(name_contains)
+        results = [
+            e for e in candidates
+            if self._fresh(e, max_age, now)
+            and (not needles or any(n in (e.name or "") for n in needles))
+            and (min_rssi is None or e.rssi >= min_rssi)
+        ]
+        results.sort(key=lambda e: e.rssi, reverse=True)
+        return results
+
+    def find_by_name(self, name: str, max_age: Optional[float] = None) -> Optional[DeviceEntry]:
+        """Strongest fresh device with exactly this name."""
+        for entry in self.find(name_prefix=name, max_age=max_age):
+            if entry.name == name:
+                return entry
+        return None
+
+    async def wait_for(self, match: Match, timeout: float = 10.0) -> Optional[DeviceEntry]:
+        """
+        Return a device matching ``match`` (an exact name or a predicate),
+        waiting up to ``timeout`` seconds for it to advertise if it has not
+        been seen recently.
+        """
+        if isinstance(match, str):
+            name = match
+            match = lambda entry: entry.name == name
+            known = self.find_by_name(name)
+        else:
+            known = next((e for e in self.find() if match(e)), None)
+        if known:
+            return known
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((match, future))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+
+class ScannerService:
+    """
+    Runs one long-lived scanner feeding a DeviceRegistry.
+
+    Args:
+        registry: Registry to populate (a new one by default).
+        scanner: BleakScanner, or a stand-in such as kettle_sim's.
+        scanning_mode: "passive" (the default, no scan requests on the air)
+            or "active". Where passive scanning isn't available the service
+            falls back to active: on BlueZ, unless ``scanner_kwargs`` holds
+            ``bluez`` args with advertisement monitor or_patterns, and
+            wherever starting a passive scanner fails.
+        scanner_kwargs: Extra arguments for the scanner.
+    """
+
+    def __init__(self, registry: Optional[DeviceRegistry] = None, scanner=BleakScanner,
+                 scanning_mode: str = "passive", scanner_kwargs: Optional[dict] = None):
+        self.registry = registry or DeviceRegistry()
+        self.scanner = scanner
+        self.scanning_mode = scanning_mode
+        self.scanner_kwargs = scanner_kwargs or {}
+        self.mode_in_use: Optional[str] = None
+        self._scanner = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._scanner is not None
+
+    async def start(self) -> bool:
+        """Start scanning. Returns False (and logs) if no scanner is available."""
+        if self._scanner is not None:
+            return True
+        mode = self.scanning_mode
+        if mode == "passive" and sys.platform.startswith("linux") and "bluez" not in self.scanner_kwargs:
+            # BlueZ only scans passively through advertisement monitor or_patterns
+            mode = "active"
+        try:
+            scanner = await self._start_scanner(mode)
+        except Exception as e:
+            if mode != "passive":
+                logger.warning(f"BLE scanner unavailable: {e}")
+                return False
+            logger.info(f"Passive scanning unavailable ({e}), scanning actively")
+            mode = "active"
+            try:
+                scanner = await self._start_scanner(mode)
+            except Exception as e:
+                logger.warning(f"BLE scanner unavailable: {e}")
+                return False
+        self._scanner = scanner
+        self.mode_in_use = mode
+        logger.info(f"📡 Background BLE scanner started ({mode})")
+        return True
+
+    async def _start_scanner(self, mode: str):
+        scanner = self.scanner(detection_callback=self.registry.observe, scanning_mode=mode, **self.scanner_kwargs)
+        await scanner.start()
+        return scanner
+
+    async def stop(self):
+        if self._scanner is not None:
+            scanner, self._scanner = self._scanner, None
+            await scanner.stop()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
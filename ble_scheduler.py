@@ -0,0 +1,155 @@
+"""
+Priority- and deadline-aware scheduling of operations on a BLE link.
+
+A kettle can only do one thing at a time over BLE, so operations queue for
+the link. OperationScheduler hands it out by priority class instead of by
+arrival, so a voice command does not wait behind a queue of dashboard
+polls, and drops operations whose deadline passes while they are queued:
+
+    scheduler = OperationScheduler()
+    async with scheduler.slot(Priority.COMMAND):
+        await kettle.set_target_temperature(93)
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Optional
+
+class Priority(IntEnum):
+    """Scheduling classes; lower values run first."""
+    COMMAND = 0     # User-initiated changes, e.g. Smart Home EXECUTE
+    QUERY = 1       # State reads for dashboards and Smart Home QUERY
+    BACKGROUND = 2  # Pre-connects and other housekeeping
+
+# Default seconds an operation of each class may wait for the link
+DEFAULT_TIMEOUTS = {
+    Priority.COMMAND: 15.0,
+    Priority.QUERY: 8.0,
+    Priority.BACKGROUND: 30.0,
+}
+
+class DeadlineExpired(asyncio.TimeoutError):
+    """An operation's deadline passed while it was still waiting for the link."""
+
+def _percentile_ms(ordered: list[float], pct: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return round(1000 * ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))], 3)
+
+class OperationScheduler:
+    """
+    Grants exclusive use of a link to one operation at a time, like an
+    asyncio.Lock, but in priority order (first come, first served within a
+    class). Operations are not preempted once they hold the link.
+
+    Args:
+        timeouts: Seconds an operation of each priority may wait before it
+            is dropped with DeadlineExpired; defaults to DEFAULT_TIMEOUTS.
+        history: Recent wait times kept per priority for stats().
+    """
+
+    def __init__(self, timeouts: Optional[dict[Priority, float]] = None, history: int = 256):
+        self.timeouts = dict(DEFAULT_TIMEOUTS if timeouts is None else timeouts)
+        self.max_depth = 0
+        self.granted = {p: 0 for p in Priority}
+        self.expired = {p: 0 for p in Priority}
+        self._held = False
+        self._queue: list[tuple[Priority, int, asyncio.Future]] = []  # Heap; cancelled entries are skipped
+        self._seq = itertools.count()
+        self._waiting = 0
+        self._waits = {p: deque(maxlen=history) for p in Priority}
+
+    def locked(self) -> bool:
+        """True while an operation holds the link."""
+        return self._held
+
+    @property
+    def depth(self) -> int:
+        """Number of operations waiting for the link."""
+        return self._waiting
+
+    async def acquire(self, priority: Priority = Priority.COMMAND, timeout: Optional[float] = None):
+        """
+        Wait for the link. ``timeout`` overrides the priority's default
+        deadline; pass math.inf to wait as long as it takes.
+
+        Raises:
+            DeadlineExpired: The deadline passed before the link was granted.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        if not self._held and not self._waiting:
+            self._held = True
+            self._granted(priority, 0.0)
+            return
+
+        if timeout is None:
+            timeout = self.timeouts.get(priority, math.inf)
+        future = loop.create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        self._waiting += 1
+        self.max_depth = max(self.max_depth, self._waiting)
+        try:
+            if math.isinf(timeout):
+                await future
+            else:
+                async with asyncio.timeout(timeout):
+                    await future
+        except (asyncio.CancelledError, TimeoutError) as e:
+            if future.done() and not future.cancelled():
+                # Granted just as the waiter gave up: hand the link on
+                self.release()
+            else:
+                future.cancel()
+                self._waiting -= 1
+            if isinstance(e, TimeoutError):
+                self.expired[priority] += 1
+                raise DeadlineExpired(f"{priority.name} operation waited more than {timeout:.1f}s") from None
+            raise
+        self._granted(priority, loop.time() - start)
+
+    def release(self):
+        """Pass the link to the most urgent waiting operation, if any."""
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                self._waiting -= 1
+                future.set_result(None)
+                return
+        self._held = False
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority = Priority.COMMAND, timeout: Optional[float] = None):
+        """Hold the link for the duration of the block."""
+        await self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _granted(self, priority: Priority, waited: float):
+        self.granted[priority] += 1
+        self._waits[priority].append(waited)
+
+    def stats(self) -> dict:
+        priorities = {}
+        for p in Priority:
+            waits = sorted(self._waits[p])
+            priorities[p.name.lower()] = {
+                "granted": self.granted[p],
+                "expired": self.expired[p],
+                "wait_p50_ms": _percentile_ms(waits, 50),
+                "wait_p95_ms": _percentile_ms(waits, 95),
+                "wait_max_ms": round(1000 * waits[-1], 3) if waits else None,
+            }
+        return {
+            "busy": self._held,
+            "depth": self._waiting,
+            "max_depth": self.max_depth,
+            "priorities": priorities,
+        }
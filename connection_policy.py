@@ -0,0 +1,184 @@
+"""
+Connection policies for KettleManager.
+"""
+
+import datetime
+import random
+import time
+from enum import Enum
+from typing import Optional
+
+class KeepAlivePolicy:
+    """
+    Decides how long an idle kettle connection is kept open.
+
+    The policy learns when requests arrive: an EWMA of the gap between
+    requests sets the idle timeout (a few typical gaps, clamped to
+    [min_idle, max_idle]), and a per-hour-of-day count of the days on which
+    that hour saw requests (decayed daily) marks recurring busy hours, e.g.
+    the morning coffee window. Busy hours hold the connection for max_idle.
+
+    Args:
+        min_idle: Shortest idle timeout, in seconds.
+        max_idle: Longest idle timeout, used throughout busy hours.
+        gap_multiplier: Idle timeout as a multiple of the typical request gap.
+        busy_threshold: Decayed number of days with requests in an hour
+            that makes the hour busy.
+        alpha: EWMA weight of the newest request gap.
+        daily_decay: Factor applied to the hourly histogram each new day.
+    """
+
+    def __init__(self, min_idle: float = 60.0, max_idle: float = 1800.0,
+                 gap_multiplier: float = 3.0, busy_threshold: float = 2.0,
+                 alpha: float = 0.2, daily_decay: float = 0.8):
+        self.min_idle = min_idle
+        self.max_idle = max_idle
+        self.gap_multiplier = gap_multiplier
+        self.busy_threshold = busy_threshold
+        self.alpha = alpha
+        self.daily_decay = daily_decay
+        self.hourly = [0.0] * 24
+        self.gap_ewma: Optional[float] = None
+        self.hits = 0
+        self.misses = 0
+        self.preconnects = 0
+        self._last_request: Optional[float] = None
+        self._day: Optional[int] = None
+        self._hours_today: set[int] = set()
+
+    def record_request(self, warm: bool, now: Optional[float] = None):
+        """Record a request, and whether it found the connection already open."""
+        now = time.time() if now is None else now
+        if warm:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        if self._last_request is not None:
+            gap = max(0.0, now - self._last_request)
+            self.gap_ewma = gap if self.gap_ewma is None else self.alpha * gap + (1 - self.alpha) * self.gap_ewma
+        self._last_request = now
+
+        local = time.localtime(now)
+        day = datetime.date(local.tm_year, local.tm_mon, local.tm_mday).toordinal()
+        if day != self._day:
+            # Decay once per day that has passed, including days without requests
+            days = max(1, day - self._day) if self._day is not None else 1
+            factor = self.daily_decay ** days
+            self.hourly = [count * factor for count in self.hourly]
+            self._hours_today.clear()
+            self._day = day
+        if local.tm_hour not in self._hours_today:
+            self._hours_today.add(local.tm_hour)
+            self.hourly[local.tm_hour] += 1
+
+    def record_preconnect(self):
+        self.preconnects += 1
+
+    def is_busy(self, now: Optional[float] = None) -> bool:
+        """True if requests usually arrive during this hour of the day."""
+        now = time.time() if now is None else now
+        return self.hourly[time.localtime(now).tm_hour] >= self.busy_threshold
+
+    def idle_timeout(self, now: Optional[float] = None) -> float:
+        """Seconds to keep an idle connection open."""
+        if self.is_busy(now):
+            return self.max_idle
+        if self.gap_ewma is None:
+            return self.min_idle
+        return max(self.min_idle, min(self.max_idle, self.gap_multiplier * self.gap_ewma))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "idle_timeout": round(self.idle_timeout(), 1),
+            "busy_now": self.is_busy(),
+            "busy_hours": [hour for hour, count in enumerate(self.hourly) if count >= self.busy_threshold],
+            "typical_gap": round(self.gap_ewma, 1) if self.gap_ewma is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+            "preconnects": self.preconnects,
+        }
+
+class BreakerState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """
+    Fails fast while a device is unreachable.
+
+    After ``failure_threshold`` consecutive connection failures the breaker
+    opens and callers are turned away at once, instead of each repeating a
+    slow discovery and connect. A probe is due ``base_delay`` seconds later;
+    the breaker is half-open while it runs, closes if it succeeds and
+    reopens with the delay multiplied by ``multiplier`` (up to ``max_delay``)
+    if it fails. Delays are randomized by +/- ``jitter``.
+    """
+
+    def __init__(self, failure_threshold: int = 2, base_delay: float = 5.0, max_delay: float = 300.0,
+                 multiplier: float = 2.0, jitter: float = 0.1):
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.delay = base_delay
+        self.next_probe_at: Optional[float] = None
+        self.trips = 0
+        self.rejected = 0
+
+    @property
+    def is_closed(self) -> bool:
+        return self.state is BreakerState.CLOSED
+
+    def allow(self) -> bool:
+        """True if a request may use the device; rejections are counted."""
+        if self.is_closed:
+            return True
+        self.rejected += 1
+        return False
+
+    def retry_after(self, now: Optional[float] = None) -> float:
+        """Seconds until the next probe is due (0 when closed or already probing)."""
+        if self.state is not BreakerState.OPEN:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.next_probe_at - now)
+
+    def begin_probe(self):
+        self.state = BreakerState.HALF_OPEN
+
+    def record_success(self):
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.delay = self.base_delay
+        self.next_probe_at = None
+
+    def record_failure(self, now: Optional[float] = None):
+        self.failures += 1
+        if self.state is BreakerState.HALF_OPEN:
+            self.delay = min(self.max_delay, self.delay * self.multiplier)
+            self._open(now)
+        elif self.state is BreakerState.CLOSED and self.failures >= self.failure_threshold:
+            self.delay = self.base_delay
+            self.trips += 1
+            self._open(now)
+
+    def _open(self, now: Optional[float]):
+        now = time.monotonic() if now is None else now
+        self.state = BreakerState.OPEN
+        self.next_probe_at = now + self.delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state.value,
+            "failures": self.failures,
+            "retry_after": round(self.retry_after(), 1),
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
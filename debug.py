@@ -1,21 +1,14 @@
 import asyncio
-from bleak import BleakScanner, BleakClient
+from bleak import BleakClient
+from ble_discovery import discover
 
 async def main():
     print("Scanning for BLE devices...")
     
-    # 1. Discover devices
-    # We increase the timeout slightly to ensure we catch advertising packets
-    devices = await BleakScanner.discover(timeout=5.0)
+    # 1. Discover devices, stopping at the first one whose name contains "EKG"
+    found = await discover(name_contains=("EKG",), timeout=5.0, limit=1)
     
-    target_device = None
-    
-    # 2. Filter for device name containing "EKG"
-    for device in devices:
-        # device.name can be None, so we must check existence first
-        if device.name and "EKG" in device.name:
-            target_device = device
-            break
+    target_device = found[0][0] if found else None
     
     if target_device is None:
         print("No device found with name containing 'EKG'.")
@@ -0,0 +1,60 @@
+"""
+Persistent name -> address cache for BLE devices.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+class AddressCache:
+    """
+    Remembers the last known address, signal strength and sighting time of
+    devices by name, in a small JSON file, so a restart can connect
+    directly instead of scanning first.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: dict[str, dict] = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable address cache {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def get(self, name: str) -> Optional[dict]:
+        """Return ``{"address", "last_seen", "rssi"}`` for a device name, if known."""
+        return self._entries.get(name)
+
+    def get_address(self, name: str) -> Optional[str]:
+        entry = self.get(name)
+        return entry["address"] if entry else None
+
+    def update(self, name: str, address: str, rssi: Optional[int] = None):
+        """
+        Record a sighting of a device and persist it. Without an ``rssi``
+        (e.g. a direct connect), the last reading at the same address is kept.
+        """
+        previous = self._entries.get(name)
+        if rssi is None and previous and previous["address"] == address:
+            rssi = previous.get("rssi")
+        self._entries[name] = {"address": address, "last_seen": time.time(), "rssi": rssi}
+        try:
+            self._save()
+        except OSError as e:
+            logger.warning(f"Could not write address cache {self.path}: {e}")
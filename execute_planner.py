@@ -0,0 +1,84 @@
+"""
+Planning for Google Smart Home EXECUTE intents.
+
+An EXECUTE payload can address the same kettle from several commands, each
+with several executions. plan_execute() folds the whole payload into one
+DevicePlan per device, holding the final state asked for, so each kettle is
+updated once, through its StateReconciler:
+
+    plans = plan_execute(payload["commands"])
+    await reconciler.update(**plans["stagg_kettle_1"].desired(kettle.state))
+"""
+
+from typing import Optional
+
+from stagg_ekg_pro import KettleState, ScheduleMode
+from state_reconciler import Schedule
+
+SET_TEMPERATURE = "action.devices.commands.SetTemperature"
+ON_OFF = "action.devices.commands.OnOff"
+
+class DevicePlan:
+    """The final target temperature and on/off state requested for one device."""
+
+    def __init__(self, device_id: str):
+        self.device_id = device_id
+        self.temperature: Optional[float] = None
+        self.on: Optional[bool] = None
+        self.states: dict = {}  # Reported back to Google on success
+
+    def add(self, command: str, params: dict):
+        """Fold in one execution; later ones override earlier ones."""
+        if command == SET_TEMPERATURE:
+            self.temperature = params.get("temperature")
+            self.states["temperatureSetpointCelsius"] = self.temperature
+        elif command == ON_OFF:
+            self.on = params.get("on", True)
+            self.states["on"] = self.on
+
+    def desired(self, state: KettleState) -> dict:
+        """
+        The reconciler fields for the plan, given the kettle's current state.
+        Turning the kettle on schedules it to heat once, a minute from the
+        kettle's clock, to the requested (or current target) temperature;
+        turning it off clears the schedule.
+        """
+        desired = {}
+        sched_mode = state.schedule_mode
+        sched_hour = state.schedule_hour
+        sched_min = state.schedule_minute
+        sched_temp = state.schedule_temperature
+        sched_updated = False
+
+        if self.temperature is not None:
+            desired["target_temp"] = self.temperature
+            sched_temp = self.temperature
+
+        if self.on is True and sched_mode == ScheduleMode.OFF:
+            if self.temperature is None:
+                sched_temp = state.target_temperature
+            sched_hour, sched_min = state.clock_hours, state.clock_minutes + 1
+            if sched_min >= 60:
+                sched_hour, sched_min = (sched_hour + 1) % 24, 0
+            sched_mode = ScheduleMode.ONCE
+            sched_updated = True
+        elif self.on is False:
+            sched_mode = ScheduleMode.OFF
+            sched_updated = True
+
+        if sched_updated or (sched_mode != ScheduleMode.OFF and self.temperature is not None):
+            desired["schedule"] = Schedule(sched_mode, sched_hour, sched_min, sched_temp)
+        return desired
+
+def plan_execute(commands: list) -> dict[str, DevicePlan]:
+    """One DevicePlan per device id, in the order devices first appear."""
+    plans: dict[str, DevicePlan] = {}
+    for command in commands:
+        execution = command.get("execution", [])
+        for device in command.get("devices", []):
+            plan = plans.get(device["id"])
+            if plan is None:
+                plan = plans[device["id"]] = DevicePlan(device["id"])
+            for exec_cmd in execution:
+                plan.add(exec_cmd.get("command"), exec_cmd.get("params", {}))
+    return plans
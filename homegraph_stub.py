@@ -0,0 +1,49 @@
+"""
+Local stand-in for Google HomeGraph's Report State endpoint, for trying out
+and testing kettle_server's Report State without a Google project:
+
+    python homegraph_stub.py --port 8090
+    KETTLE_REPORT_STATE_URL=http://localhost:8090/v1/devices:reportStateAndNotification python kettle_server.py
+
+Reports are kept in memory; GET /reports lists them along with the merged
+latest state of every device.
+"""
+
+import argparse
+
+from fastapi import FastAPI, HTTPException, Request
+
+app = FastAPI()
+reports: list[dict] = []
+states: dict[str, dict[str, dict]] = {}  # agent user id -> device id -> latest state
+
+@app.post("/v1/devices:reportStateAndNotification")
+async def report_state_and_notification(request: Request):
+    body = await request.json()
+    agent_user_id = body.get("agentUserId")
+    devices = body.get("payload", {}).get("devices", {}).get("states")
+    if not agent_user_id or not isinstance(devices, dict):
+        raise HTTPException(status_code=400, detail="agentUserId and payload.devices.states are required")
+
+    reports.append(body)
+    for device_id, device_state in devices.items():
+        states.setdefault(agent_user_id, {}).setdefault(device_id, {}).update(device_state)
+    return {"requestId": body.get("requestId")}
+
+@app.get("/reports")
+async def get_reports():
+    return {"reports": reports, "states": states}
+
+@app.delete("/reports")
+async def clear_reports():
+    reports.clear()
+    states.clear()
+    return {"status": "ok"}
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Local stand-in for HomeGraph Report State")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port)
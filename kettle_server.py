@@ -1,18 +1,30 @@
 import asyncio
 import logging
+import math
+import os
 import sqlite3
 import secrets
 import time
 from contextlib import asynccontextmanager
-from typing import Optional
+from typing import Callable, Optional
 from fastapi import FastAPI, HTTPException, Request, Form, Depends
-from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse
+from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
 from bleak import BleakScanner
 
-from stagg_ekg_pro import StaggEKGPro, ScheduleMode
+from stagg_ekg_pro import StaggEKGPro, KettleState, NotificationHub, ScheduleMode
+from connection_policy import KeepAlivePolicy, CircuitBreaker
+from device_cache import AddressCache
+from ble_registry import ScannerService
+from ble_scheduler import OperationScheduler, Priority, DeadlineExpired
+from token_cache import TokenCache
+from sqlite_pool import SQLitePool, GroupCommitWriter
+from signed_tokens import TokenSigner
+from execute_planner import DevicePlan, plan_execute
+from state_reconciler import Schedule, StateReconciler
+from report_state import CommandToken, ReportStatePublisher, google_state
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -20,15 +32,53 @@ logger = logging.getLogger("kettle-server")
 
 # Configuration
 DEFAULT_KETTLE_NAME = "EKG-a8-41-f0" # Default name for Smart Home connection
-DB_PATH = "kettle_oauth.db"
+DB_PATH = os.environ.get("KETTLE_DB_PATH", "kettle_oauth.db")
+ADDRESS_CACHE_PATH = os.environ.get("KETTLE_ADDRESS_CACHE", "kettle_devices.json")
+# Comma-separated kettle names; the n-th one is Smart Home device "stagg_kettle_<n>"
+KETTLE_NAMES = [n.strip() for n in os.environ.get("KETTLE_NAMES", DEFAULT_KETTLE_NAME).split(",") if n.strip()]
+ACCESS_TOKEN_TTL = 3600
+# How long a refresh token stays usable after the access token issued with it expires
+REFRESH_TOKEN_TTL = int(os.environ.get("KETTLE_REFRESH_TOKEN_TTL", 180 * 24 * 3600))
+# When set, access tokens are HMAC-signed with this secret and verified without the database
+TOKEN_SECRET = os.environ.get("KETTLE_TOKEN_SECRET")
+# When set, kettle state changes are pushed to this HomeGraph reportStateAndNotification URL
+# (or homegraph_stub) and SYNC advertises willReportState
+REPORT_STATE_URL = os.environ.get("KETTLE_REPORT_STATE_URL")
+HOMEGRAPH_TOKEN = os.environ.get("KETTLE_HOMEGRAPH_TOKEN")
+# Command printing a current HomeGraph access token, rerun before each one expires; preferred over
+# the static KETTLE_HOMEGRAPH_TOKEN, e.g. "gcloud auth print-access-token --impersonate-service-account=..."
+HOMEGRAPH_TOKEN_COMMAND = os.environ.get("KETTLE_HOMEGRAPH_TOKEN_COMMAND")
+# Reports wait for the first Smart Home request to learn the user unless this is set
+AGENT_USER_ID = os.environ.get("KETTLE_AGENT_USER_ID")
 
 class DatabaseManager:
-    def __init__(self, db_path):
+    """
+    OAuth codes and tokens in SQLite. Queries run through an SQLitePool, on
+    long-lived WAL connections in worker threads, so they don't block the
+    event loop; writes are group-committed by a single GroupCommitWriter.
+    Refresh tokens are rotated on use, and a reaper task deletes expired
+    codes and tokens in batches.
+    With a ``token_signer``, access tokens retired or revoked here are also
+    revoked there, since signed tokens are verified without the database.
+    """
+    def __init__(self, db_path, token_cache: Optional[TokenCache] = None, pool_size: int = 2,
+                 refresh_token_ttl: int = REFRESH_TOKEN_TTL, token_signer: Optional[TokenSigner] = None):
         self.db_path = db_path
+        self.refresh_token_ttl = refresh_token_ttl
+        # Validated access tokens, so verify_token usually skips the database
+        self.token_cache = token_cache or TokenCache()
+        self.token_signer = token_signer
+        self.pool = SQLitePool(db_path, size=pool_size)
+        self.writer = GroupCommitWriter(self.pool)
+        self._reaper_task: Optional[asyncio.Task] = None
         self._init_db()
 
     def _init_db(self):
         with sqlite3.connect(self.db_path) as conn:
+            # Lets the reaper return freed pages to the OS (takes effect for new database files)
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # WAL lets token lookups proceed while another connection writes
+            conn.execute("PRAGMA journal_mode=WAL")
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS tokens (
                     access_token TEXT PRIMARY KEY,
@@ -44,60 +94,192 @@ class DatabaseManager:
                     expires_at INTEGER
                 )
             """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tokens_refresh_token ON tokens (refresh_token)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tokens_expires_at ON tokens (expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_auth_codes_expires_at ON auth_codes (expires_at)")
             conn.commit()
 
-    def store_auth_code(self, code, user_id, expires_in=300):
-        expires_at = int(time.time()) + expires_in
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("INSERT INTO auth_codes (code, user_id, expires_at) VALUES (?, ?, ?)",
-                         (code, user_id, expires_at))
-            conn.commit()
-
-    def validate_auth_code(self, code):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("SELECT user_id, expires_at FROM auth_codes WHERE code = ?", (code,))
-            row = cursor.fetchone()
-            if row:
-                user_id, expires_at = row
-                # Delete code after use
-                conn.execute("DELETE FROM auth_codes WHERE code = ?", (code,))
-                conn.commit()
-                if expires_at > time.time():
-                    return user_id
-            return None
+    async def close(self):
+        if self._reaper_task:
+            self._reaper_task.cancel()
+            self._reaper_task = None
+        await self.writer.close()
+        await self.pool.close()
 
-    def store_tokens(self, access_token, refresh_token, user_id, expires_in=3600):
+    async def store_auth_code(self, code, user_id, expires_in=300):
         expires_at = int(time.time()) + expires_in
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("INSERT OR REPLACE INTO tokens (access_token, refresh_token, user_id, expires_at) VALUES (?, ?, ?, ?)",
-                         (access_token, refresh_token, user_id, expires_at))
-            conn.commit()
+        await self.writer.execute("INSERT INTO auth_codes (code, user_id, expires_at) VALUES (?, ?, ?)",
+                                (code, user_id, expires_at))
 
-    def get_token(self, access_token):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("SELECT user_id, expires_at FROM tokens WHERE access_token = ?", (access_token,))
-            row = cursor.fetchone()
-            if row:
-                user_id, expires_at = row
-                if expires_at > time.time():
-                    return user_id
+    @staticmethod
+    def _consume_auth_code(conn, code):
+        row = conn.execute("SELECT user_id, expires_at FROM auth_codes WHERE code = ?", (code,)).fetchone()
+        if row is None:
+            return None
+        # Delete code after use; only the caller whose delete succeeds may use it
+        if conn.execute("DELETE FROM auth_codes WHERE code = ?", (code,)).rowcount != 1:
             return None
+        return row
 
-    def validate_refresh_token(self, refresh_token):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("SELECT user_id FROM tokens WHERE refresh_token = ?", (refresh_token,))
-            row = cursor.fetchone()
-            return row[0] if row else None
+    async def validate_auth_code(self, code):
+        row = await self.writer.write(self._consume_auth_code, code)
+        if row:
+            user_id, expires_at = row
+            if expires_at > time.time():
+                return user_id
+        return None
 
-db = DatabaseManager(DB_PATH)
+    async def store_tokens(self, access_token, refresh_token, user_id, expires_in=3600):
+        expires_at = int(time.time()) + expires_in
+        await self.writer.execute("INSERT OR REPLACE INTO tokens (access_token, refresh_token, user_id, expires_at) VALUES (?, ?, ?, ?)",
+                                  (access_token, refresh_token, user_id, expires_at))
+        self.token_cache.invalidate(access_token)
+
+    async def get_token(self, access_token):
+        user_id = self.token_cache.get(access_token)
+        if user_id is not None:
+            return user_id
+        generation = self.token_cache.generation
+        row = await self.pool.fetchone("SELECT user_id, expires_at FROM tokens WHERE access_token = ?", (access_token,))
+        if row:
+            user_id, expires_at = row
+            if expires_at > time.time():
+                self.token_cache.put(access_token, user_id, expires_at, generation=generation)
+                return user_id
+        return None
+
+    def _forget(self, access_token):
+        """Make an access token that is no longer in the database unusable."""
+        self.token_cache.invalidate(access_token)
+        if self.token_signer and self.token_signer.is_signed(access_token):
+            self.token_signer.revoke(access_token)
+
+    @staticmethod
+    def _revoke(conn, token):
+        rows = conn.execute("SELECT access_token FROM tokens WHERE access_token = ? OR refresh_token = ?",
+                            (token, token)).fetchall()
+        conn.execute("DELETE FROM tokens WHERE access_token = ? OR refresh_token = ?", (token, token))
+        return [row[0] for row in rows]
+
+    async def revoke_token(self, token):
+        """Revoke an access or refresh token, along with the other token of its pair."""
+        retired = await self.writer.write(self._revoke, token)
+        for access_token in {token, *retired}:
+            self._forget(access_token)
+
+    async def revoke_user_tokens(self, user_id):
+        await self.writer.execute("DELETE FROM tokens WHERE user_id = ?", (user_id,))
+        self.token_cache.invalidate_user(user_id)
+        if self.token_signer:
+            self.token_signer.revoke_user(user_id)
+
+    async def validate_refresh_token(self, refresh_token):
+        row = await self.pool.fetchone("SELECT user_id FROM tokens WHERE refresh_token = ? AND expires_at > ?",
+                                       (refresh_token, int(time.time()) - self.refresh_token_ttl))
+        return row[0] if row else None
+
+    @staticmethod
+    def _rotate(conn, old_refresh_token, access_token, refresh_token, expires_at, valid_after):
+        rows = conn.execute("SELECT access_token, user_id FROM tokens WHERE refresh_token = ? AND expires_at > ?",
+                            (old_refresh_token, valid_after)).fetchall()
+        if not rows:
+            return None
+        conn.execute("DELETE FROM tokens WHERE refresh_token = ?", (old_refresh_token,))
+        user_id = rows[0][1]
+        conn.execute("INSERT INTO tokens (access_token, refresh_token, user_id, expires_at) VALUES (?, ?, ?, ?)",
+                     (access_token, refresh_token, user_id, expires_at))
+        return user_id, [row[0] for row in rows]
 
-app = FastAPI()
+    async def rotate_refresh_token(self, old_refresh_token, access_token, refresh_token, expires_in=3600):
+        """
+        Exchange a refresh token for a new token pair, retiring the old row
+        (and its access token). Returns the user id, or None if the refresh
+        token is unknown or expired.
+        """
+        now = int(time.time())
+        rotated = await self.writer.write(self._rotate, old_refresh_token, access_token, refresh_token,
+                                          now + expires_in, now - self.refresh_token_ttl)
+        if rotated is None:
+            return None
+        user_id, retired = rotated
+        for old_access_token in retired:
+            self._forget(old_access_token)
+        return user_id
+
+    async def reap_expired(self, batch_size: int = 500) -> int:
+        """Delete expired auth codes and tokens, a batch per transaction. Returns the rows deleted."""
+        now = int(time.time())
+        deleted = 0
+        for sql, cutoff in (
+            ("DELETE FROM auth_codes WHERE rowid IN (SELECT rowid FROM auth_codes WHERE expires_at < ? LIMIT ?)", now),
+            ("DELETE FROM tokens WHERE rowid IN (SELECT rowid FROM tokens WHERE expires_at < ? LIMIT ?)",
+             now - self.refresh_token_ttl),
+        ):
+            while True:
+                count = await self.writer.execute(sql, (cutoff, batch_size))
+                deleted += count
+                if count < batch_size:
+                    break
+        if deleted:
+            await self.writer.write(self._incremental_vacuum)
+        return deleted
+
+    @staticmethod
+    def _incremental_vacuum(conn):
+        # sqlite3 steps the pragma once, and each step frees a single page
+        pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        for _ in range(pages):
+            conn.execute("PRAGMA incremental_vacuum")
+
+    async def _reaper_loop(self, interval: float):
+        while True:
+            try:
+                deleted = await self.reap_expired()
+                if deleted:
+                    logger.info(f"Reaped {deleted} expired auth codes and tokens")
+            except sqlite3.Error as e:
+                logger.warning(f"Token reaper failed: {e}")
+            await asyncio.sleep(interval)
+
+    def start_reaper(self, interval: float = 3600.0):
+        """Periodically delete expired rows in the background."""
+        if self._reaper_task is None:
+            self._reaper_task = asyncio.create_task(self._reaper_loop(interval))
+
+token_signer = TokenSigner(TOKEN_SECRET) if TOKEN_SECRET else None
+db = DatabaseManager(DB_PATH, token_signer=token_signer)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup: connect in the background so the first request finds a warm link
+    await scanner_service.start()
+    kettle_pool.start()
+    db.start_reaper()
+    if report_state:
+        for device_id, manager in kettle_pool.items():
+            report_state.watch(device_id, manager.hub)
+            manager.on_reachable = lambda reachable, device_id=device_id: report_state.report(
+                device_id, {"online": reachable}
+            )
+    yield
+    # Shutdown
+    if report_state:
+        await report_state.close()
+    await kettle_pool.close()
+    await scanner_service.stop()
+    await db.close()
+
+app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="templates")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 async def verify_token(token: str = Depends(oauth2_scheme)):
-    user_id = db.get_token(token)
+    if token_signer and token_signer.is_signed(token):
+        # Signature, expiry and revocation checks only; no I/O
+        user_id = token_signer.verify(token)
+    else:
+        user_id = await db.get_token(token)
     if not user_id:
         raise HTTPException(
             status_code=401,
@@ -127,10 +309,16 @@ async def authorize_submit(redirect_uri: str = Form(...), state: str = Form(...)
     Redirects back to Google with a temporary auth code.
     """
     code = secrets.token_urlsafe(16)
-    db.store_auth_code(code, username)
+    await db.store_auth_code(code, username)
     url = f"{redirect_uri}?code={code}&state={state}"
     return RedirectResponse(url=url, status_code=302)
 
+def _new_access_token(user_id, expires_in):
+    """A signed token when KETTLE_TOKEN_SECRET is set, otherwise an opaque one."""
+    if token_signer:
+        return token_signer.issue(user_id, expires_in)
+    return secrets.token_urlsafe(32)
+
 @app.post("/token")
 async def token(
     grant_type: str = Form(...),
@@ -144,22 +332,28 @@ async def token(
     Google sends requests as application/x-www-form-urlencoded.
     """
     if grant_type == "authorization_code":
-        user_id = db.validate_auth_code(code)
+        user_id = await db.validate_auth_code(code)
         if not user_id:
             raise HTTPException(status_code=400, detail="Invalid or expired authorization code")
         logger.info(f"Exchanging code for tokens for user {user_id}")
-    elif grant_type == "refresh_token":
-        user_id = db.validate_refresh_token(refresh_token)
+    elif grant_type != "refresh_token":
+        raise HTTPException(status_code=400, detail="Invalid grant_type")
+
+    old_refresh_token = refresh_token
+    refresh_token = secrets.token_urlsafe(32)
+    expires_in = ACCESS_TOKEN_TTL
+    if grant_type == "refresh_token":
+        user_id = await db.validate_refresh_token(old_refresh_token)
         if not user_id:
             raise HTTPException(status_code=400, detail="Invalid refresh token")
+        access_token = _new_access_token(user_id, expires_in)
+        # Rotation: the old refresh token and its access token are retired
+        if not await db.rotate_refresh_token(old_refresh_token, access_token, refresh_token, expires_in):
+            raise HTTPException(status_code=400, detail="Invalid refresh token")
         logger.info(f"Refreshing access token for user {user_id}")
     else:
-        raise HTTPException(status_code=400, detail="Invalid grant_type")
-
-    access_token = secrets.token_urlsafe(32)
-    refresh_token = secrets.token_urlsafe(32)
-    expires_in = 3600
-    db.store_tokens(access_token, refresh_token, user_id, expires_in)
+        access_token = _new_access_token(user_id, expires_in)
+        await db.store_tokens(access_token, refresh_token, user_id, expires_in)
 
     # Return tokens in the format Google expects
     return {
@@ -169,7 +363,90 @@ async def token(
         "expires_in": expires_in
     }
 
+@app.post("/revoke")
+async def revoke(token: str = Form(...), token_type_hint: Optional[str] = Form(None)):
+    """
+    OAuth2 token revocation (RFC 7009).
+    Unknown tokens are not an error, so the response never reveals whether a token existed.
+    """
+    await db.revoke_token(token)
+    return {}
+
 # --- Smart Home Fulfillment ---
+def _sync_device(device_id: str, manager: "KettleManager", primary: bool) -> dict:
+    return {
+        "id": device_id,
+        "type": "action.devices.types.KETTLE",
+        "traits": [
+            "action.devices.traits.OnOff",
+            "action.devices.traits.TemperatureControl",
+        ],
+        "name": {
+            "name": "Fellow Stagg EKG Pro" if primary else f"Fellow Stagg EKG Pro ({manager.name_prefix})",
+            # Shared nicknames would make voice commands ambiguous, so only the first kettle gets them
+            "nicknames": ["My Kettle", "Coffee Kettle"] if primary else []
+        },
+        # Only while reports get through, so Google keeps polling otherwise
+        "willReportState": report_state is not None and report_state.healthy,
+        "attributes": {
+            "temperatureRange": {
+                "minThresholdCelsius": 40,
+                "maxThresholdCelsius": 100
+            },
+            "temperatureUnitForUX": "C",
+            "commandOnlyTemperatureSetting": False,
+            "queryOnlyTemperatureSetting": False
+        }
+    }
+
+async def _query_device(device_id: str) -> dict:
+    manager = kettle_pool.get(device_id)
+    if manager is None:
+        return {"online": False, "errorCode": "deviceNotFound"}
+    try:
+        state = await manager.read_state()
+        if state is None:
+            # Connected, but without a complete payload to decode: report the defaults
+            return {
+                "online": True,
+                "on": False,
+                "temperatureSetpointCelsius": 85,
+                "temperatureAmbientCelsius": 85,
+            }
+        # Same mapping as Report State, so both tell Google the same thing
+        return google_state(state)
+    except Exception as e:
+        logger.error(f"Smarthome Query Error ({device_id}): {e}")
+        return {"online": False, "errorCode": "deviceOffline"}
+
+async def _execute_device(plan: DevicePlan) -> dict:
+    manager = kettle_pool.get(plan.device_id)
+    if manager is None:
+        return {"ids": [plan.device_id], "status": "ERROR", "errorCode": "deviceNotFound"}
+
+    status = "SUCCESS"
+    try:
+        # One reconciler update for everything asked of this kettle, so the
+        # reconciler enforces these values rather than earlier ones
+        state = await manager.read_state()
+        if state is None:
+            raise RuntimeError("no complete state to plan against")
+        desired = plan.desired(state)
+        if desired:
+            await manager.reconciler.update(**desired)
+    except Exception as e:
+        status = "ERROR"
+        logger.error(f"Execute Error ({plan.device_id}): {e}")
+
+    result = {
+        "ids": [plan.device_id],
+        "status": status,
+        "states": plan.states
+    }
+    if status == "ERROR" and not manager.breaker.is_closed:
+        result["errorCode"] = "deviceOffline"
+    return result
+
 @app.post("/smarthome")
 async def smarthome(request: Request, user_id: str = Depends(verify_token)):
     data = await request.json()
@@ -182,139 +459,40 @@ async def smarthome(request: Request, user_id: str = Depends(verify_token)):
     
     intent = inputs[0].get("intent")
     payload = {}
+
+    if report_state:
+        # Any intent names the user, so reports resume after a restart without waiting for a SYNC
+        report_state.set_agent_user(user_id)
     
     if intent == "action.devices.SYNC":
         payload = {
             "agentUserId": user_id,
-            "devices": [{
-                "id": "stagg_kettle_1",
-                "type": "action.devices.types.KETTLE",
-                "traits": [
-                    "action.devices.traits.OnOff",
-                    "action.devices.traits.TemperatureControl",
-                ],
-                "name": {
-                    "name": "Fellow Stagg EKG Pro",
-                    "nicknames": ["My Kettle", "Coffee Kettle"]
-                },
-                "willReportState": False,
-                "attributes": {
-                    "temperatureRange": {
-                        "minThresholdCelsius": 40,
-                        "maxThresholdCelsius": 100
-                    },
-                    "temperatureUnitForUX": "C",
-                    "commandOnlyTemperatureSetting": False,
-                    "queryOnlyTemperatureSetting": False
-                }
-            }]
+            "devices": [
+                _sync_device(device_id, manager, primary=(i == 0))
+                for i, (device_id, manager) in enumerate(kettle_pool.items())
+            ]
         }
         
     elif intent == "action.devices.QUERY":
-        devices = {}
-        try:
-            async with kettle_manager.get_kettle() as k:
-                await k.refresh_state()
-                all_state = k.get_all_states()
-                
-                target_temp = all_state.get("target_temperature", 85)
-                # We report target as ambient since we don't have ambient reading easily accessible as a property yet
-                # ideally we should read current temp if available
-                ambient_temp = target_temp 
-                
-                # Check schedule/heating status for 'on' state
-                schedule = all_state.get("schedule", {})
-                is_on = schedule.get("mode", "off") != "off"
-                
-                devices["stagg_kettle_1"] = {
-                    "online": True,
-                    "on": is_on,
-                    "temperatureSetpointCelsius": target_temp,
-                    "temperatureAmbientCelsius": ambient_temp,
-                }
-        except Exception as e:
-            logger.error(f"Smarthome Query Error: {e}")
-            devices["stagg_kettle_1"] = {"online": False, "errorCode": "deviceOffline"}
-            
-        payload = {"devices": devices}
+        requested = inputs[0].get("payload", {}).get("devices")
+        device_ids = [d["id"] for d in requested] if requested else list(kettle_pool.ids())
+        # Kettles are queried concurrently; each one only waits on its own scheduler
+        states = await asyncio.gather(*(_query_device(device_id) for device_id in device_ids))
+        payload = {"devices": dict(zip(device_ids, states))}
 
     elif intent == "action.devices.EXECUTE":
         commands = inputs[0].get("payload", {}).get("commands", [])
-        results = []
-        
-        for command in commands:
-            devices_to_execute = command.get("devices", [])
-            execution = command.get("execution", [])
-            
-            for d in devices_to_execute:
-                if d["id"] == "stagg_kettle_1":
-                    status = "SUCCESS"
-                    states = {}
-                    try:
-                        async with kettle_manager.get_kettle() as k:
-                            await k.refresh_state()
-                            current_state = k.get_all_states()
-                            current_schedule = current_state.get("schedule", {})
-                            
-                            # Track updates to apply at once if they affect the schedule
-                            sched_mode = current_schedule.get("mode", "off")
-                            sched_hour = current_schedule.get("hour", 0)
-                            sched_min = current_schedule.get("minute", 0)
-                            sched_temp = current_schedule.get("temperature_celsius", 85)
-                            sched_updated = False
-
-                            for exec_cmd in execution:
-                                cmd_name = exec_cmd.get("command")
-                                params = exec_cmd.get("params", {})
-                                
-                                if cmd_name == "action.devices.commands.SetTemperature":
-                                    temp = params.get("temperature")
-                                    await k.set_target_temperature(temp)
-                                    states["temperatureSetpointCelsius"] = temp
-                                    sched_temp = temp
-                                elif cmd_name == "action.devices.commands.OnOff":
-                                    on_val = params.get("on", True)
-                                    states["on"] = on_val
-                                    if on_val:
-                                        # Turn On
-                                        if sched_mode == "off":
-                                            # Use actual target temp if we are just "turning on"
-                                            # without a specific temperature command in this request
-                                            if not any(c.get("command") == "action.devices.commands.SetTemperature" for c in execution):
-                                                sched_temp = current_state.get("target_temperature", sched_temp)
-
-                                            h = current_state.get("clock_hours", 0)
-                                            m = current_state.get("clock_minutes", 0) + 1
-                                            if m >= 60:
-                                                m = 0
-                                                h = (h + 1) % 24
-                                            sched_mode = "once"
-                                            sched_hour = h
-                                            sched_min = m
-                                            sched_updated = True
-                                    else:
-                                        # Turn Off
-                                        sched_mode = "off"
-                                        sched_updated = True
-
-                            if sched_updated or (sched_mode != "off" and any(c.get("command") == "action.devices.commands.SetTemperature" for c in execution)):
-                                mode_enum = ScheduleMode.OFF
-                                if sched_mode == "daily": mode_enum = ScheduleMode.DAILY
-                                elif sched_mode == "once": mode_enum = ScheduleMode.ONCE
-                                
-                                await k.set_schedule(mode=mode_enum, hour=sched_hour, minute=sched_min, temp_celsius=sched_temp)
-
-                    except Exception as e:
-                        status = "ERROR"
-                        logger.error(f"Execute Error: {e}")
-                        
-                    results.append({
-                        "ids": [d["id"]],
-                        "status": status,
-                        "states": states
-                    })
-
-        payload = {"commands": results}
+        # Fold all commands into one plan per kettle, then update the kettles in parallel
+        plans = plan_execute(commands)
+        results = await asyncio.gather(*(_execute_device(plan) for plan in plans.values()))
+
+        payload = {"commands": list(results)}
+
+    elif intent == "action.devices.DISCONNECT":
+        # The user unlinked the kettles from Google Home; none of their tokens should work any more
+        logger.info(f"Unlinking user {user_id}")
+        await db.revoke_user_tokens(user_id)
+        return {}
 
     return {
         "requestId": request_id,
@@ -337,30 +515,120 @@ class ScheduleRequest(BaseModel):
 # Helpers
 class KettleManager:
     """
-    Manages a persistent connection to the kettle and serializes access.
-    Automatically disconnects after an idle period.
+    Manages a persistent connection to the kettle and serializes access
+    through an OperationScheduler: user commands go ahead of queries, which
+    go ahead of background work, and operations that wait past their
+    deadline are dropped.
+    Disconnects after an idle period chosen by a KeepAlivePolicy, which
+    adapts to when requests usually arrive, and can pre-connect ahead of them.
+    With an ``address_cache``, the kettle's address is remembered across
+    restarts and only re-scanned for, in the background, when connecting to
+    it directly fails.
+    With a running ``scanner_service``, discovery is answered from its
+    registry instead of a dedicated scan.
+    Repeated connection failures open a CircuitBreaker: requests are then
+    refused at once with a 503 while a background task probes the kettle
+    with backoff, and the breaker closes again once a probe connects.
+    ``on_reachable``, if set, is called with False when the breaker opens
+    and with True when it closes again.
+    A link that drops is re-established by StaggEKGPro in the background;
+    requests arriving meanwhile wait up to ``reconnect_wait`` seconds for it
+    before connecting themselves. State updates of every connection are
+    published to the manager's ``hub``, so subscriptions outlive reconnects.
+    Settings changed through the ``reconciler`` skip writes that would not
+    change the kettle and merge with changes made in quick succession.
+    ``scanner`` and ``client_factory`` default to bleak and can be replaced,
+    e.g. by kettle_sim.KettleSimulator for load testing.
     """
-    def __init__(self, name_prefix: str = DEFAULT_KETTLE_NAME, idle_timeout: float = 60.0):
+    def __init__(self, name_prefix: str = DEFAULT_KETTLE_NAME, idle_timeout: float = 60.0,
+                 scanner=BleakScanner, client_factory=None,
+                 policy: Optional[KeepAlivePolicy] = None, preconnect_check_interval: float = 300.0,
+                 address_cache: Optional[AddressCache] = None,
+                 scanner_service: Optional[ScannerService] = None,
+                 breaker: Optional[CircuitBreaker] = None, reconnect_wait: float = 5.0):
         self.name_prefix = name_prefix
-        self.idle_timeout = idle_timeout
+        self.address_cache = address_cache
+        self.scanner_service = scanner_service
+        self.policy = policy or KeepAlivePolicy(min_idle=idle_timeout)
+        self.preconnect_check_interval = preconnect_check_interval
+        self.scanner = scanner
+        self.client_factory = client_factory
         self.address: Optional[str] = None
         self.kettle: Optional[StaggEKGPro] = None
-        self.lock = asyncio.Lock()
+        self.scheduler = OperationScheduler()
+        self.breaker = breaker or CircuitBreaker()
+        self.reconnect_wait = reconnect_wait
+        self.hub = NotificationHub()
+        self.reconciler = StateReconciler(
+            lambda: self.get_kettle(Priority.COMMAND), hub=self.hub, peek=self.cached_state
+        )
+        self.on_reachable: Optional[Callable[[bool], None]] = None
         self._disconnect_task: Optional[asyncio.Task] = None
+        self._keepalive_task: Optional[asyncio.Task] = None
+        self._revalidate_task: Optional[asyncio.Task] = None
+        self._probe_task: Optional[asyncio.Task] = None
+        self._read_flight: Optional[asyncio.Future] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return bool(self.kettle and self.kettle.client and self.kettle.client.is_connected)
 
     async def _discover_address(self):
         logger.info(f"Connecting to device with name '{self.name_prefix}'...")
-        device = await BleakScanner.find_device_by_name(self.name_prefix, timeout=10.0)
+        if self.scanner_service and self.scanner_service.is_running:
+            entry = await self.scanner_service.registry.wait_for(self.name_prefix, timeout=10.0)
+            if not entry:
+                return None
+            if self.address_cache:
+                self.address_cache.update(self.name_prefix, entry.address, round(entry.rssi))
+            return entry.address
+
+        rssi = None
+
+        def match(device, adv):
+            nonlocal rssi
+            if (adv.local_name or device.name) == self.name_prefix:
+                rssi = adv.rssi
+                return True
+            return False
+
+        device = await self.scanner.find_device_by_filter(match, timeout=10.0)
+        if not device:
+            return None
+        if self.address_cache:
+            self.address_cache.update(self.name_prefix, device.address, rssi)
         return device.address
 
+    async def _revalidate_address(self):
+        """Scan for the kettle in the background after a direct connect failed."""
+        address = await self._discover_address()
+        if address and address != self.address:
+            logger.info(f"Kettle '{self.name_prefix}' moved to {address}")
+            async with self.scheduler.slot(Priority.BACKGROUND, math.inf):
+                self.address = address
+                await self._drop_kettle()
+
+    def _start_revalidation(self):
+        if self._revalidate_task is None or self._revalidate_task.done():
+            self._revalidate_task = asyncio.create_task(self._revalidate_address())
+
+    async def _drop_kettle(self):
+        """
+        Disconnect and forget the kettle. A kettle whose link dropped is
+        reconnecting in the background, so it is disconnected too.
+        """
+        kettle, self.kettle = self.kettle, None
+        if kettle:
+            await kettle.disconnect()
+
     async def _auto_disconnect(self):
         """Task that waits for idle timeout and then disconnects."""
-        await asyncio.sleep(self.idle_timeout)
-        async with self.lock:
-            if self.kettle and self.kettle.client and self.kettle.client.is_connected:
-                logger.info(f"Idle timeout reached ({self.idle_timeout}s). Disconnecting...")
-                await self.kettle.disconnect()
-            self.kettle = None
+        idle_timeout = self.policy.idle_timeout()
+        await asyncio.sleep(idle_timeout)
+        async with self.scheduler.slot(Priority.BACKGROUND, math.inf):
+            if self.kettle:
+                logger.info(f"Idle timeout reached ({idle_timeout:.0f}s). Disconnecting...")
+            await self._drop_kettle()
 
     def _reset_disconnect_timer(self):
         """Cancels any existing disconnect task and starts a new one."""
@@ -368,100 +636,332 @@ class KettleManager:
             self._disconnect_task.cancel()
         self._disconnect_task = asyncio.create_task(self._auto_disconnect())
 
+    async def _ensure_connected(self):
+        """Discover and connect to the kettle if needed. Must hold the scheduler slot."""
+        if self.address is None and self.address_cache:
+            self.address = self.address_cache.get_address(self.name_prefix)
+
+        if self.address is None:
+            self.address = await self._discover_address()
+            if not self.address:
+                raise HTTPException(status_code=404, detail="Kettle not found.")
+
+        if self.kettle is None:
+            self.kettle = StaggEKGPro(self.address, hub=self.hub, client_factory=self.client_factory)
+        
+        if not self.kettle.client or not self.kettle.client.is_connected:
+            if self.kettle.reconnecting and await self.kettle.ready(self.reconnect_wait):
+                return
+            logger.info(f"Connecting to kettle at {self.address}...")
+            connected = await self.kettle.connect()
+            if not connected:
+                await self._drop_kettle()
+                if self.address_cache:
+                    # Keep the known address and check it with a scan off the request path
+                    self._start_revalidation()
+                else:
+                    # Clear address to force re-discovery next time
+                    self.address = None
+                raise HTTPException(status_code=500, detail="Failed to connect to kettle.")
+            if self.address_cache:
+                # A direct connect is a sighting too, so last_seen stays current
+                self.address_cache.update(self.name_prefix, self.address)
+
+    async def _connect(self):
+        """_ensure_connected, reporting the outcome to the circuit breaker."""
+        try:
+            await self._ensure_connected()
+        except Exception:
+            self.breaker.record_failure()
+            if not self.breaker.is_closed:
+                logger.warning(f"Kettle '{self.name_prefix}' unreachable, "
+                               f"failing fast for {self.breaker.retry_after():.1f}s")
+                self._start_probing()
+                if self.on_reachable:
+                    self.on_reachable(False)
+            raise
+        self.breaker.record_success()
+
+    def _reject_if_open(self):
+        if not self.breaker.allow():
+            raise HTTPException(
+                status_code=503,
+                detail="Kettle unreachable.",
+                headers={"Retry-After": str(math.ceil(self.breaker.retry_after()) or 1)},
+            )
+
+    async def _probe_loop(self):
+        """Probe an unreachable kettle, backing off, until it connects again."""
+        while not self.breaker.is_closed:
+            await asyncio.sleep(self.breaker.retry_after())
+            self.breaker.begin_probe()
+            try:
+                async with self.scheduler.slot(Priority.BACKGROUND, math.inf):
+                    await self._ensure_connected()
+            except Exception as e:
+                self.breaker.record_failure()
+                logger.info(f"Probe failed ({getattr(e, 'detail', e)}), "
+                            f"next in {self.breaker.retry_after():.1f}s")
+                continue
+            self.breaker.record_success()
+            self._reset_disconnect_timer()
+            logger.info(f"Kettle '{self.name_prefix}' reachable again")
+            if self.on_reachable:
+                self.on_reachable(True)
+
+    def _start_probing(self):
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def preconnect(self):
+        """Connect ahead of requests. Failures are logged, not raised."""
+        if not self.breaker.is_closed:
+            return  # The probe task is already trying
+        try:
+            async with self.scheduler.slot(Priority.BACKGROUND):
+                if self.is_connected:
+                    return
+                try:
+                    await self._connect()
+                except Exception as e:
+                    logger.warning(f"Pre-connect failed: {getattr(e, 'detail', e)}")
+                    return
+                self.policy.record_preconnect()
+                self._reset_disconnect_timer()
+        except DeadlineExpired:
+            logger.info("Pre-connect skipped, the kettle stayed busy")
+
+    async def _keepalive_loop(self):
+        """Pre-connect at startup, and again whenever a busy hour begins."""
+        await self.preconnect()
+        while True:
+            await asyncio.sleep(self.preconnect_check_interval)
+            if not self.is_connected and self.policy.is_busy():
+                await self.preconnect()
+
+    def start(self):
+        """Start background pre-connecting and watching for settings drift."""
+        if self._keepalive_task is None:
+            self._keepalive_task = asyncio.create_task(self._keepalive_loop())
+        self.reconciler.start()
+
+    async def close(self):
+        """Stop background tasks and disconnect."""
+        await self.reconciler.close()
+        for task in (self._keepalive_task, self._disconnect_task, self._revalidate_task, self._probe_task):
+            if task:
+                task.cancel()
+        self._keepalive_task = None
+        self._disconnect_task = None
+        async with self.scheduler.slot(Priority.COMMAND, math.inf):
+            await self._drop_kettle()
+
+    def cached_state(self) -> Optional[KettleState]:
+        """The cached state if it is fresh and nothing holds the kettle, else None."""
+        kettle = self.kettle
+        if (not self.scheduler.locked() and self.is_connected
+                and kettle.state_age is not None and kettle.state_age <= kettle.max_staleness):
+            return kettle.state
+        return None
+
+    async def read_state(self) -> Optional[KettleState]:
+        """
+        Current state of the kettle, or None if it sent an incomplete payload.
+
+        A fresh cached state is returned without queueing when nothing else
+        holds the kettle. Otherwise one read is scheduled as a query and
+        every caller that arrives while it is pending shares its result (or
+        its error).
+        """
+        state = self.cached_state()
+        if state is not None:
+            self.policy.record_request(warm=True)
+            self._reset_disconnect_timer()
+            return state
+
+        if self._read_flight is None:
+            self._read_flight = asyncio.ensure_future(self._locked_read())
+            self._read_flight.add_done_callback(self._read_done)
+        return await asyncio.shield(self._read_flight)
+
+    async def _locked_read(self) -> Optional[KettleState]:
+        async with self.get_kettle(Priority.QUERY) as k:
+            await k.ensure_state()
+            return k.state
+
+    def _read_done(self, flight: asyncio.Future):
+        self._read_flight = None
+        if not flight.cancelled():
+            flight.exception()  # Retrieved here in case every caller was cancelled
+
     @asynccontextmanager
-    async def get_kettle(self):
+    async def get_kettle(self, priority: Priority = Priority.COMMAND, timeout: Optional[float] = None):
         """
         Context manager to safely acquire and use the kettle client.
         Ensures only one request interacts with the kettle at a time and
         manages the auto-disconnect timer.
+        Requests wait for the kettle in ``priority`` order and fail with a
+        503 if they are still queued after ``timeout`` seconds (by default,
+        the scheduler's deadline for the priority), or at once while the
+        circuit breaker is open.
         """
-        async with self.lock:
+        self._reject_if_open()
+        try:
+            await self.scheduler.acquire(priority, timeout)
+        except DeadlineExpired as e:
+            logger.warning(f"Dropped queued kettle operation: {e}")
+            raise HTTPException(status_code=503, detail="Kettle busy, request expired in queue.")
+
+        try:
+            # The breaker may have opened while this request was queued
+            self._reject_if_open()
+
             # Cancel disconnect timer while kettle is in use
             if self._disconnect_task:
                 self._disconnect_task.cancel()
                 self._disconnect_task = None
 
-            if self.address is None:
-                self.address = await self._discover_address()
-                if not self.address:
-                    raise HTTPException(status_code=404, detail="Kettle not found.")
-
-            if self.kettle is None:
-                self.kettle = StaggEKGPro(self.address)
-            
-            if not self.kettle.client or not self.kettle.client.is_connected:
-                logger.info(f"Connecting to kettle at {self.address}...")
-                connected = await self.kettle.connect()
-                print("Connected!")
-                if not connected:
-                    # Clear address to force re-discovery next time
-                    self.address = None
-                    self.kettle = None
-                    raise HTTPException(status_code=500, detail="Failed to connect to kettle.")
+            self.policy.record_request(warm=self.is_connected)
+            await self._connect()
             
             try:
                 yield self.kettle
             except Exception as e:
                 logger.error(f"Kettle operation failed: {e}")
                 # If a communication error occurs, we drop the connection
-                if self.kettle:
-                    await self.kettle.disconnect()
-                self.kettle = None
+                await self._drop_kettle()
                 raise
             finally:
                 # Start/Reset the disconnect timer after the operation is done
                 self._reset_disconnect_timer()
+        finally:
+            self.scheduler.release()
+
+class KettlePool:
+    """
+    One KettleManager per kettle, keyed by Smart Home device id. Every kettle
+    has its own connection, scheduler and idle timer, so a slow kettle does not
+    hold up requests to the others.
+    """
+    def __init__(self, managers: dict[str, KettleManager]):
+        if not managers:
+            raise ValueError("KettlePool needs at least one kettle")
+        self.managers = managers
+
+    @classmethod
+    def from_names(cls, names: list[str], **manager_kwargs) -> "KettlePool":
+        """Pool with device ids stagg_kettle_1, stagg_kettle_2, ... for ``names`` in order."""
+        return cls({
+            f"stagg_kettle_{i}": KettleManager(name, **manager_kwargs)
+            for i, name in enumerate(names, 1)
+        })
+
+    def ids(self):
+        return self.managers.keys()
 
-kettle_manager = KettleManager()
+    def items(self):
+        return self.managers.items()
+
+    def get(self, device_id: str) -> Optional[KettleManager]:
+        return self.managers.get(device_id)
+
+    def resolve(self, device_name: Optional[str] = None) -> KettleManager:
+        """
+        Manager for a device id or kettle name; the first kettle if none is given.
+        Raises a 404 HTTPException for unknown kettles.
+        """
+        if device_name is None:
+            return next(iter(self.managers.values()))
+        manager = self.managers.get(device_name)
+        if manager is None:
+            manager = next((m for m in self.managers.values() if m.name_prefix == device_name), None)
+        if manager is None:
+            raise HTTPException(status_code=404, detail=f"Unknown kettle '{device_name}'.")
+        return manager
+
+    def start(self):
+        for manager in self.managers.values():
+            manager.start()
+
+    async def close(self):
+        await asyncio.gather(*(manager.close() for manager in self.managers.values()))
+
+scanner_service = ScannerService()
+report_state = (
+    ReportStatePublisher(
+        REPORT_STATE_URL, agent_user_id=AGENT_USER_ID,
+        token=CommandToken(HOMEGRAPH_TOKEN_COMMAND) if HOMEGRAPH_TOKEN_COMMAND else HOMEGRAPH_TOKEN,
+    )
+    if REPORT_STATE_URL else None
+)
+kettle_pool = KettlePool.from_names(
+    KETTLE_NAMES, address_cache=AddressCache(ADDRESS_CACHE_PATH), scanner_service=scanner_service
+)
 
 # Routes
 
+@app.get("/api/stats")
+async def get_stats(_token: str = Depends(verify_token)):
+    """Token cache and database writer counters, and connection policy, cache, scheduler, circuit breaker and reconciler counters per kettle, and Report State counters."""
+    return {
+        "token_cache": db.token_cache.stats(),
+        "signed_tokens": token_signer.stats() if token_signer else None,
+        "db_writer": db.writer.stats(),
+        "connection": {device_id: manager.policy.stats() for device_id, manager in kettle_pool.items()},
+        "scheduler": {device_id: manager.scheduler.stats() for device_id, manager in kettle_pool.items()},
+        "breaker": {device_id: manager.breaker.stats() for device_id, manager in kettle_pool.items()},
+        "reconciler": {device_id: manager.reconciler.stats() for device_id, manager in kettle_pool.items()},
+        "report_state": report_state.stats() if report_state else None,
+    }
+
 @app.get("/api/state")
 async def get_state(device_name: Optional[str] = None, _token: str = Depends(verify_token)):
     """
     Connects to the kettle, gets state, and disconnects.
     """
-    async with kettle_manager.get_kettle() as k:
-        await k.refresh_state()
-        state = k.get_all_states()
-        state["connected"] = True
-        state["device_name"] = k.address
-        return state
+    manager = kettle_pool.resolve(device_name)
+    state = await manager.read_state()
+    if state is None:
+        raise HTTPException(status_code=503, detail="Kettle sent an incomplete state.")
+    return Response(
+        content=state.to_json(connected=True, device_name=manager.address),
+        media_type="application/json"
+    )
 
 @app.post("/api/temperature")
 async def set_temperature(req: TargetTempRequest, device_name: Optional[str] = None, _token: str = Depends(verify_token)):
-    """Connects, sets target temperature, and disconnects."""
-    async with kettle_manager.get_kettle() as k:
-        await k.set_target_temperature(req.temperature)
-        return {"status": "ok", "target": req.temperature}
+    """Sets the target temperature; a no-op if the kettle already has it."""
+    await kettle_pool.resolve(device_name).reconciler.update(target_temp=req.temperature)
+    return {"status": "ok", "target": req.temperature}
 
 @app.post("/api/hold")
 async def set_hold(req: HoldRequest, device_name: Optional[str] = None, _token: str = Depends(verify_token)):
-    """Connects, sets hold time, and disconnects."""
-    async with kettle_manager.get_kettle() as k:
-        await k.set_hold_time(req.minutes)
-        return {"status": "ok", "hold_minutes": req.minutes}
+    """Sets the hold time; a no-op if the kettle already has it."""
+    await kettle_pool.resolve(device_name).reconciler.update(hold_time=req.minutes)
+    return {"status": "ok", "hold_minutes": req.minutes}
 
 @app.post("/api/schedule")
 async def set_schedule(req: ScheduleRequest, device_name: Optional[str] = None, _token: str = Depends(verify_token)):
-    """Connects, sets schedule, and disconnects."""
-    async with kettle_manager.get_kettle() as k:
-        mode_map = {
-            "off": ScheduleMode.OFF,
-            "once": ScheduleMode.ONCE,
-            "daily": ScheduleMode.DAILY
-        }
-        
-        if req.mode not in mode_map:
-            raise HTTPException(status_code=400, detail="Invalid schedule mode")
-            
-        await k.set_schedule(
+    """Sets the schedule; a no-op if the kettle already has it."""
+    mode_map = {
+        "off": ScheduleMode.OFF,
+        "once": ScheduleMode.ONCE,
+        "daily": ScheduleMode.DAILY
+    }
+
+    if req.mode not in mode_map:
+        raise HTTPException(status_code=400, detail="Invalid schedule mode")
+
+    try:
+        await kettle_pool.resolve(device_name).reconciler.update(schedule=Schedule(
             mode=mode_map[req.mode],
             hour=req.hour,
             minute=req.minute,
             temp_celsius=req.temperature
-        )
-        return {"status": "ok", "schedule": req.dict()}
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "ok", "schedule": req.dict()}
 
 if __name__ == "__main__":
     import uvicorn
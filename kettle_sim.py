@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+In-process Fellow Stagg EKG Pro simulator.
+
+Speaks the same 17-byte protocol as stagg_ekg_pro.py over a fake BLE link
+with configurable latency, jitter, packet loss and disconnects, so the
+servers can be load-tested on a machine without a radio:
+
+    sim = KettleSimulator(LinkProfile(read_latency=0.08, write_latency=0.1))
+    sim.add_kettle("EKG-a8-41-f0", "A8:41:F0:00:00:01")
+    async with sim:
+        kettle = StaggEKGPro("A8:41:F0:00:00:01", client_factory=sim.client)
+        manager = KettleManager(scanner=sim.scanner, client_factory=sim.client)
+
+``sim.client`` stands in for BleakClient and ``sim.scanner`` for
+BleakScanner (both its class methods and ``BleakScanner(detection_callback=...)``).
+"""
+
+import asyncio
+import logging
+import random
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from bleak import BleakError
+from bleak.backends.device import BLEDevice
+from bleak.backends.scanner import AdvertisementData
+
+from stagg_ekg_pro import (
+    MAIN_CONFIG_UUID, _Payload, _StatusFlags, ScheduleMode, _schedule_mode_of
+)
+
+logger = logging.getLogger(__name__)
+
+# A freshly reset kettle: 85°C target, Celsius, digital clock at 07:00, English
+DEFAULT_PAYLOAD = bytes.fromhex("00 02 00 80 aa 00 c0 00 00 00 00 07 01 00 05 00 00")
+
+@dataclass
+class LinkProfile:
+    """Timing and fault model for the simulated BLE link (seconds / probabilities)."""
+    connect_latency: float = 1.5
+    read_latency: float = 0.06
+    write_latency: float = 0.06
+    notify_latency: float = 0.03
+    scan_latency: float = 0.5      # Time until a kettle's first advertisement is seen
+    jitter: float = 0.2            # Each latency varies by up to this fraction either way
+    connect_failure_rate: float = 0.0
+    drop_rate: float = 0.0         # Reads/writes lost in transit
+    disconnect_rate: float = 0.0   # Chance the link drops on any operation
+    seed: Optional[int] = None
+
+class SimulatedKettle:
+    """
+    State and physics of one simulated kettle.
+
+    The kettle clock advances with simulated time, schedules fire when the
+    clock reaches them (ONCE schedules then disable themselves), and water
+    heats toward the target while heating and cools toward ambient
+    otherwise. ``water_temp`` and ``heating`` are simulator-only: the real
+    protocol does not report them.
+    """
+
+    def __init__(self, name: str, address: str, payload: bytes = DEFAULT_PAYLOAD,
+                 rssi: int = -60, ambient_temp: float = 20.0,
+                 heating_rate: float = 0.3, cooling_coefficient: float = 0.0005):
+        self.name = name
+        self.address = address
+        self.rssi = rssi
+        self.advertising = True
+        self.ambient_temp = ambient_temp
+        self.heating_rate = heating_rate
+        self.cooling_coefficient = cooling_coefficient
+        self.water_temp = ambient_temp
+        self.heating = False
+        self.heat_target: Optional[float] = None
+        self._payload = bytearray(payload)
+        self._clock_seconds = 0.0
+        self._hold_remaining: Optional[float] = None
+        self._last_fired: Optional[tuple[int, int]] = None
+        self._listeners: list[Callable[[bytes], None]] = []
+
+    @property
+    def payload(self) -> bytes:
+        return bytes(self._payload)
+
+    def _notify(self):
+        data = bytes(self._payload)
+        for listener in list(self._listeners):
+            listener(data)
+
+    def apply_write(self, data: bytes):
+        """Accept a payload written by a client and echo it as a notification."""
+        if len(data) != 17:
+            raise BleakError("Invalid payload length")
+        self._payload = bytearray(data)
+        self._notify()
+
+    def start_heating(self, target: Optional[float] = None):
+        """Start heating, e.g. when a schedule fires."""
+        self.heat_target = target if target is not None else self._payload[_Payload.TARGET_TEMP] / 2.0
+        self.heating = True
+        self._hold_remaining = None
+
+    def tick(self, dt: float):
+        """Advance the simulation by ``dt`` seconds."""
+        self._advance_clock(dt)
+        self._advance_water(dt)
+
+    def _advance_clock(self, dt: float):
+        self._clock_seconds += dt
+        changed = False
+        while self._clock_seconds >= 60:
+            self._clock_seconds -= 60
+            minutes = self._payload[_Payload.CLOCK_MINUTES] + 1
+            hours = self._payload[_Payload.CLOCK_HOURS]
+            if minutes >= 60:
+                minutes = 0
+                hours = (hours + 1) % 24
+            self._payload[_Payload.CLOCK_MINUTES] = minutes
+            self._payload[_Payload.CLOCK_HOURS] = hours
+            changed = True
+            self._check_schedule()
+        if changed:
+            self._notify()
+
+    def _check_schedule(self):
+        mode = _schedule_mode_of(self._payload)
+        if mode == ScheduleMode.OFF:
+            return
+        now = (self._payload[_Payload.CLOCK_HOURS], self._payload[_Payload.CLOCK_MINUTES])
+        scheduled = (self._payload[_Payload.SCHEDULE_HOURS], self._payload[_Payload.SCHEDULE_MINUTES])
+        if now != scheduled or self._last_fired == now:
+            return
+        self._last_fired = now
+        self.start_heating(self._payload[_Payload.SCHEDULE_TEMP] / 2.0)
+        if mode == ScheduleMode.ONCE:
+            self._payload[_Payload.STATUS_FLAGS] &= ~_StatusFlags.SCHEDULE_ENABLED
+        logger.debug(f"{self.name}: schedule fired, heating to {self.heat_target}°C")
+
+    def _advance_water(self, dt: float):
+        if self.heating and self.heat_target is not None:
+            if self.water_temp < self.heat_target:
+                self.water_temp = min(self.heat_target, self.water_temp + self.heating_rate * dt)
+                return
+            if self._hold_remaining is None:
+                self._hold_remaining = self._payload[_Payload.HOLD_TIME] * 60.0
+            self._hold_remaining -= dt
+            if self._hold_remaining > 0:
+                return
+            self.heating = False
+            self._hold_remaining = None
+        self.water_temp -= (self.water_temp - self.ambient_temp) * self.cooling_coefficient * dt
+
+class SimulatedBleakClient:
+    """Stands in for BleakClient against a KettleSimulator."""
+
+    def __init__(self, sim: "KettleSimulator", address_or_ble_device, disconnected_callback: Optional[Callable] = None, **kwargs):
+        self._sim = sim
+        self.address = getattr(address_or_ble_device, "address", address_or_ble_device)
+        self._disconnected_callback = disconnected_callback
+        self._kettle: Optional[SimulatedKettle] = None
+        self._callback: Optional[Callable] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._kettle is not None
+
+    def _check_link(self):
+        if self._kettle is None:
+            raise BleakError("Not connected")
+        if self._sim._chance(self._sim.profile.disconnect_rate):
+            self._lose_link()
+            raise BleakError("Device disconnected")
+
+    def _lose_link(self):
+        self._detach()
+        self._sim.stats["disconnects"] += 1
+        if self._disconnected_callback:
+            asyncio.get_running_loop().call_soon(self._disconnected_callback, self)
+
+    def _detach(self):
+        if self._kettle is not None and self._on_payload in self._kettle._listeners:
+            self._kettle._listeners.remove(self._on_payload)
+        self._kettle = None
+        self._callback = None
+
+    def _on_payload(self, data: bytes):
+        if self._callback is None:
+            return
+        loop = asyncio.get_running_loop()
+        loop.call_later(self._sim._latency(self._sim.profile.notify_latency), self._deliver, data)
+
+    def _deliver(self, data: bytes):
+        if self._callback is not None:
+            self._sim.stats["notifications"] += 1
+            self._callback(MAIN_CONFIG_UUID, bytearray(data))
+
+    async def connect(self, **kwargs) -> bool:
+        await asyncio.sleep(self._sim._latency(self._sim.profile.connect_latency))
+        kettle = self._sim.kettles.get(self.address)
+        if kettle is None or not kettle.advertising or self._sim._chance(self._sim.profile.connect_failure_rate):
+            self._sim.stats["connect_failures"] += 1
+            raise BleakError(f"Device with address {self.address} was not found")
+        self._kettle = kettle
+        self._sim.stats["connects"] += 1
+        return True
+
+    async def disconnect(self) -> bool:
+        self._detach()
+        return True
+
+    async def read_gatt_char(self, char, **kwargs) -> bytearray:
+        self._check_link()
+        await asyncio.sleep(self._sim._latency(self._sim.profile.read_latency))
+        self._check_link()
+        if self._sim._chance(self._sim.profile.drop_rate):
+            self._sim.stats["dropped"] += 1
+            raise BleakError("Read timed out")
+        self._sim.stats["reads"] += 1
+        return bytearray(self._kettle.payload)
+
+    async def write_gatt_char(self, char, data, response: Optional[bool] = None):
+        self._check_link()
+        await asyncio.sleep(self._sim._latency(self._sim.profile.write_latency))
+        self._check_link()
+        if self._sim._chance(self._sim.profile.drop_rate):
+            self._sim.stats["dropped"] += 1
+            if response is False:
+                return  # Lost silently; only a missing echo reveals it
+            raise BleakError("Write timed out")
+        self._sim.stats["writes"] += 1
+        self._kettle.apply_write(bytes(data))
+
+    async def start_notify(self, char, callback: Callable, **kwargs):
+        self._check_link()
+        self._callback = callback
+        if self._on_payload not in self._kettle._listeners:
+            self._kettle._listeners.append(self._on_payload)
+
+    async def stop_notify(self, char):
+        if self._kettle is not None and self._on_payload in self._kettle._listeners:
+            self._kettle._listeners.remove(self._on_payload)
+        self._callback = None
+
+class _SimulatedScannerSession:
+    """Stands in for a BleakScanner instance (start/stop with a detection callback)."""
+
+    def __init__(self, sim: "KettleSimulator", detection_callback: Optional[Callable] = None, **kwargs):
+        self._sim = sim
+        self._detection_callback = detection_callback
+        self._task: Optional[asyncio.Task] = None
+        self._seen: dict[str, tuple[BLEDevice, AdvertisementData]] = {}
+
+    @property
+    def discovered_devices_and_advertisement_data(self) -> dict:
+        return dict(self._seen)
+
+    @property
+    def discovered_devices(self) -> list[BLEDevice]:
+        return [d for d, _ in self._seen.values()]
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._advertise())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _advertise(self):
+        await asyncio.sleep(self._sim._latency(self._sim.profile.scan_latency))
+        while True:
+            for kettle in list(self._sim.kettles.values()):
+                if not kettle.advertising:
+                    continue
+                device, adv = self._sim._advertisement(kettle)
+                self._seen[device.address] = (device, adv)
+                if self._detection_callback:
+                    self._detection_callback(device, adv)
+            await asyncio.sleep(self._sim.advertising_interval)
+
+class SimulatedScanner:
+    """Stands in for the BleakScanner class against a KettleSimulator."""
+
+    def __init__(self, sim: "KettleSimulator"):
+        self._sim = sim
+
+    def __call__(self, detection_callback: Optional[Callable] = None, **kwargs) -> _SimulatedScannerSession:
+        return _SimulatedScannerSession(self._sim, detection_callback, **kwargs)
+
+    async def find_device_by_filter(self, filterfunc: Callable, timeout: float = 10.0, **kwargs) -> Optional[BLEDevice]:
+        found: asyncio.Future = asyncio.get_running_loop().create_future()
+
+        def on_advertisement(device, adv):
+            if not found.done() and filterfunc(device, adv):
+                found.set_result(device)
+
+        async with self(on_advertisement):
+            try:
+                return await asyncio.wait_for(found, timeout)
+            except asyncio.TimeoutError:
+                return None
+
+    async def find_device_by_name(self, name: str, timeout: float = 10.0, **kwargs) -> Optional[BLEDevice]:
+        return await self.find_device_by_filter(lambda d, adv: adv.local_name == name, timeout)
+
+    async def find_device_by_address(self, address: str, timeout: float = 10.0, **kwargs) -> Optional[BLEDevice]:
+        return await self.find_device_by_filter(lambda d, adv: d.address.upper() == address.upper(), timeout)
+
+    async def discover(self, timeout: float = 5.0, *, return_adv: bool = False, **kwargs):
+        session = self(None)
+        async with session:
+            await asyncio.sleep(timeout)
+        if return_adv:
+            return session.discovered_devices_and_advertisement_data
+        return session.discovered_devices
+
+class KettleSimulator:
+    """
+    A simulated BLE environment holding one or more kettles.
+
+    Args:
+        profile: Link timing and fault model.
+        time_scale: Simulated seconds per real second for the kettle clock
+            and heating model.
+        tick_interval: Real seconds between physics updates.
+        advertising_interval: Real seconds between advertisements.
+    """
+
+    def __init__(self, profile: Optional[LinkProfile] = None, time_scale: float = 1.0,
+                 tick_interval: float = 0.1, advertising_interval: float = 0.1):
+        self.profile = profile or LinkProfile()
+        self.time_scale = time_scale
+        self.tick_interval = tick_interval
+        self.advertising_interval = advertising_interval
+        self.kettles: dict[str, SimulatedKettle] = {}
+        self.scanner = SimulatedScanner(self)
+        self.stats = {
+            "connects": 0, "connect_failures": 0, "disconnects": 0,
+            "reads": 0, "writes": 0, "notifications": 0, "dropped": 0,
+        }
+        self._random = random.Random(self.profile.seed)
+        self._task: Optional[asyncio.Task] = None
+
+    def add_kettle(self, name: str = "EKG-a8-41-f0", address: str = "A8:41:F0:00:00:01", **kwargs) -> SimulatedKettle:
+        kettle = SimulatedKettle(name, address, **kwargs)
+        self.kettles[address] = kettle
+        return kettle
+
+    def client(self, address_or_ble_device, **kwargs) -> SimulatedBleakClient:
+        """Client factory: use in place of BleakClient."""
+        return SimulatedBleakClient(self, address_or_ble_device, **kwargs)
+
+    def _latency(self, base: float) -> float:
+        jitter = self.profile.jitter
+        return max(0.0, base * (1 + self._random.uniform(-jitter, jitter)))
+
+    def _chance(self, rate: float) -> bool:
+        return rate > 0 and self._random.random() < rate
+
+    def _advertisement(self, kettle: SimulatedKettle) -> tuple[BLEDevice, AdvertisementData]:
+        rssi = kettle.rssi + self._random.randint(-4, 4)
+        device = BLEDevice(kettle.address, kettle.name, None)
+        adv = AdvertisementData(
+            local_name=kettle.name, manufacturer_data={}, service_data={},
+            service_uuids=[], tx_power=None, rssi=rssi, platform_data=(),
+        )
+        return device, adv
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        last = loop.time()
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            now = loop.time()
+            for kettle in list(self.kettles.values()):
+                kettle.tick((now - last) * self.time_scale)
+            last = now
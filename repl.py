@@ -2,7 +2,8 @@ import asyncio
 import logging
 import sys
 import time
-from bleak import BleakScanner, BleakError
+from bleak import BleakError
+from ble_discovery import discover
 from stagg_ekg_pro import StaggEKGPro
 
 # Configure logging to show info but not be too noisy
@@ -11,19 +12,13 @@ logger = logging.getLogger("repl")
 logger.setLevel(logging.INFO)
 
 async def scan_for_devices():
-    print("Scanning for Stagg EKG Pro devices (5 seconds)...")
-    devices = await BleakScanner.discover(return_adv=True, timeout=5.0)
-    
-    candidates = []
-    for d, a in devices.values():
-        name = d.name or ""
-        # Filter for likely candidates
-        if "Stagg" in name or "Fellow" in name or "EKG" in name:
-            candidates.append((d, a))
-    
-    # Sort by RSSI
-    candidates.sort(key=lambda x: x[1].rssi, reverse=True)
-    return candidates
+    print("Scanning for Stagg EKG Pro devices (up to 5 seconds)...")
+    # Filter for likely candidates; returns (sorted by RSSI) once no new ones appear
+    return await discover(
+        name_contains=("Stagg", "Fellow", "EKG"),
+        timeout=5.0,
+        on_candidate=lambda d, a: print(f"  found {d.name} ({d.address})"),
+    )
 
 async def async_input(prompt: str) -> str:
     """Async wrapper for input() to avoid blocking the loop."""
@@ -94,8 +89,7 @@ async def main():
         # Optional: Ask to list all devices?
         choice = await async_input("Show all detected BLE devices? (y/n): ")
         if choice.lower().startswith('y'):
-             devices = await BleakScanner.discover(return_adv=True, timeout=3.0)
-             candidates = sorted([(d, a) for d, a in devices.values()], key=lambda x: x[1].rssi, reverse=True)
+             candidates = await discover(timeout=3.0, settle=None)
         else:
             return
 
@@ -0,0 +1,252 @@
+"""
+Google Home Report State for the kettles served by kettle_server.
+
+ReportStatePublisher watches each kettle's notification hub, maps the
+fields that changed to the Smart Home state schema and pushes them to
+HomeGraph, so Google doesn't have to poll with QUERY intents:
+
+    publisher = ReportStatePublisher(HOMEGRAPH_URL, token=access_token)
+    publisher.watch("stagg_kettle_1", manager.hub)
+
+Changes are collected for ``debounce`` seconds and sent as one report
+holding the latest state of every device that changed. Reachability isn't
+part of the kettle's state, so kettle_server reports it separately with
+``report(device_id, {"online": ...})``. homegraph_stub provides a local
+stand-in for the endpoint.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from typing import Awaitable, Callable, Optional, Union
+
+import httpx
+
+from stagg_ekg_pro import KettleState, NotificationHub, OverflowPolicy, ScheduleMode, StateChange
+
+logger = logging.getLogger(__name__)
+
+HOMEGRAPH_URL = "https://homegraph.googleapis.com/v1/devices:reportStateAndNotification"
+
+def google_state(state: KettleState) -> dict:
+    """A kettle state in the Smart Home schema used by QUERY and Report State."""
+    return {
+        "online": True,
+        "on": state.schedule_mode != ScheduleMode.OFF,
+        "temperatureSetpointCelsius": state.target_temperature,
+        # There is no ambient reading, so the target stands in for it
+        "temperatureAmbientCelsius": state.target_temperature,
+    }
+
+# KettleState.to_dict() keys google_state() is derived from
+_SOURCE_FIELDS = frozenset({'target_temperature', 'schedule'})
+
+def changed_google_state(change: StateChange) -> dict:
+    """The Smart Home state fields a change altered."""
+    if not change.changed & _SOURCE_FIELDS:
+        return {}
+    previous = google_state(change.previous) if change.previous is not None else {}
+    return {k: v for k, v in google_state(change.state).items() if previous.get(k) != v}
+
+class CommandToken:
+    """
+    Access token provider running a command that prints a token, e.g.
+    ``gcloud auth print-access-token --impersonate-service-account=...``.
+    The token is reused for ``lifetime`` seconds (HomeGraph tokens last an
+    hour) or until invalidate() is called, then the command is run again.
+    """
+
+    def __init__(self, command: str, lifetime: float = 3000.0):
+        self.command = command
+        self.lifetime = lifetime
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+
+    async def __call__(self) -> str:
+        if self._token is None or time.monotonic() >= self._expires_at:
+            proc = await asyncio.create_subprocess_shell(
+                self.command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            out, err = await proc.communicate()
+            token = out.decode().strip()
+            if proc.returncode != 0 or not token:
+                raise RuntimeError(f"Token command failed ({proc.returncode}): {err.decode().strip()}")
+            self._token = token
+            self._expires_at = time.monotonic() + self.lifetime
+        return self._token
+
+    def invalidate(self):
+        """Fetch a new token before the next report."""
+        self._token = None
+
+class ReportStatePublisher:
+    """
+    Args:
+        endpoint: HomeGraph's reportStateAndNotification URL, or a stand-in.
+        agent_user_id: The user the devices belong to; otherwise reports
+            wait until set_agent_user() is called (on any Smart Home
+            request).
+        token: OAuth access token sent as a bearer token, if any, or an
+            async callable returning a current one before each report
+            (HomeGraph tokens from a service account expire after an hour),
+            such as a CommandToken. A provider with an ``invalidate()``
+            method is asked for a new token after HomeGraph refuses one.
+        debounce: Seconds changes are collected before being sent.
+        max_retry_delay: Longest wait between retries of a failed report;
+            failures back off exponentially up to it.
+        client: httpx client to send with; one is created if not given.
+    """
+
+    def __init__(self, endpoint: str, agent_user_id: Optional[str] = None,
+                 token: Optional[Union[str, Callable[[], Awaitable[str]]]] = None,
+                 debounce: float = 1.0, max_retry_delay: float = 60.0,
+                 client: Optional[httpx.AsyncClient] = None):
+        self.endpoint = endpoint
+        self.agent_user_id = agent_user_id
+        self.token = token
+        self.debounce = debounce
+        self.max_retry_delay = max_retry_delay
+        self.reports = 0
+        self.failures = 0
+        self.dropped = 0
+        self.auth_failures = 0
+        self._credentials_ok = True
+        self._client = client
+        self._own_client = client is None
+        self._pending: dict[str, dict] = {}    # device id -> states not sent yet
+        self._reported: dict[str, dict] = {}   # device id -> states Google has
+        self._task: Optional[asyncio.Task] = None
+        self._watchers: dict[str, asyncio.Task] = {}
+
+    @property
+    def healthy(self) -> bool:
+        """False while HomeGraph refuses the credentials, i.e. reports aren't getting through."""
+        return self._credentials_ok
+
+    def watch(self, device_id: str, hub: NotificationHub):
+        """Report the state changes published to ``hub`` as device ``device_id``."""
+        task = self._watchers.get(device_id)
+        if task is None or task.done():
+            self._watchers[device_id] = asyncio.create_task(self._watch(device_id, hub))
+
+    async def _watch(self, device_id: str, hub: NotificationHub):
+        async with hub.subscribe(policy=OverflowPolicy.COALESCE) as updates:
+            async for change in updates:
+                states = changed_google_state(change)
+                if states:
+                    self.report(device_id, states)
+
+    def set_agent_user(self, user_id: str):
+        """Set the user reports are sent for, sending any held back for lack of one."""
+        if user_id != self.agent_user_id:
+            # A new user's HomeGraph doesn't have anything reported so far
+            self._reported.clear()
+            self.agent_user_id = user_id
+        self._kick()
+
+    def report(self, device_id: str, states: dict):
+        """Queue state fields for the next report, newer values replacing older ones."""
+        self._pending.setdefault(device_id, {}).update(states)
+        self._kick()
+
+    def _kick(self):
+        if self._pending and self.agent_user_id and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        delay = self.debounce
+        while self._pending and self.agent_user_id:
+            await asyncio.sleep(delay)
+            batch, self._pending = self._unreported(self._pending), {}
+            if not batch:
+                continue
+            try:
+                await self._send(batch)
+            except httpx.HTTPStatusError as e:
+                status = e.response.status_code
+                if status in (401, 403):
+                    self.auth_failures += 1
+                    self._credentials_ok = False
+                    logger.error(f"HomeGraph refused the Report State credentials ({status}); "
+                                 f"check the configured token: {e.response.text}")
+                    if callable(self.token):
+                        # The provider may hand out a fresh token next time
+                        invalidate = getattr(self.token, "invalidate", None)
+                        if invalidate:
+                            invalidate()
+                        delay = self._requeue(batch, delay, e)
+                        continue
+                if status < 500 and status != 429:
+                    # Retrying won't fix a rejected report
+                    self.dropped += 1
+                    if status not in (401, 403):
+                        logger.error(f"Report State rejected ({status}): {e.response.text}")
+                    delay = self.debounce
+                    continue
+                delay = self._requeue(batch, delay, e)
+            except Exception as e:
+                # Network errors, a failing token provider or anything unexpected
+                delay = self._requeue(batch, delay, e)
+            else:
+                self.reports += 1
+                self._credentials_ok = True
+                for device_id, states in batch.items():
+                    self._reported.setdefault(device_id, {}).update(states)
+                delay = self.debounce
+
+    def _unreported(self, pending: dict[str, dict]) -> dict[str, dict]:
+        """Pending states without the fields Google already has."""
+        batch = {}
+        for device_id, states in pending.items():
+            reported = self._reported.get(device_id, {})
+            changed = {k: v for k, v in states.items() if k not in reported or reported[k] != v}
+            if changed:
+                batch[device_id] = changed
+        return batch
+
+    def _requeue(self, batch: dict[str, dict], delay: float, error: Exception) -> float:
+        """Put a failed batch back under anything newer; returns the delay before retrying."""
+        self.failures += 1
+        for device_id, states in batch.items():
+            self._pending[device_id] = {**states, **self._pending.get(device_id, {})}
+        delay = min(self.max_retry_delay, max(1.0, delay * 2))
+        logger.warning(f"Report State failed ({error!r}), retrying in {delay:.0f}s")
+        return delay
+
+    async def _send(self, batch: dict[str, dict]):
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=10.0)
+        token = await self.token() if callable(self.token) else self.token
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        body = {
+            "requestId": uuid.uuid4().hex,
+            "agentUserId": self.agent_user_id,
+            "payload": {"devices": {"states": batch}},
+        }
+        response = await self._client.post(self.endpoint, json=body, headers=headers)
+        response.raise_for_status()
+        logger.debug(f"Reported state of {', '.join(batch)}")
+
+    async def close(self):
+        """Stop watching and give up on unsent reports."""
+        for task in self._watchers.values():
+            task.cancel()
+        self._watchers.clear()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._client is not None and self._own_client:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "reports": self.reports,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "auth_failures": self.auth_failures,
+            "healthy": self.healthy,
+            "pending_devices": len(self._pending),
+            "agent_user_id_known": self.agent_user_id is not None,
+        }
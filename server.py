@@ -4,13 +4,14 @@ from contextlib import asynccontextmanager
 from typing import Optional
 
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 
-from bleak import BleakScanner
+from ble_registry import ScannerService
 from stagg_ekg_pro import StaggEKGPro, ScheduleMode, Units, ClockMode
+from state_reconciler import Schedule, StateReconciler
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -18,14 +19,19 @@ logger = logging.getLogger("server")
 
 # Global State
 kettle: Optional[StaggEKGPro] = None
+# Settings changes go through this, so repeated or rapid values (e.g. from the
+# temperature slider) are merged or skipped instead of each costing a write
+reconciler: Optional[StateReconciler] = None
+scanner_service = ScannerService()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    await scanner_service.start()
     yield
     # Shutdown
-    if kettle:
-        await kettle.disconnect()
+    await scanner_service.stop()
+    await _drop_kettle()
 
 app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -53,39 +59,45 @@ class HoldRequest(BaseModel):
 async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+KETTLE_NAME_HINTS = ("Stagg", "Fellow", "EKG")
+
 @app.get("/api/scan")
-async def scan_devices():
-    """Scan for BLE devices and return potential Stagg EKG Pro kettles."""
-    logger.info("Scanning for devices...")
-    devices = await BleakScanner.discover(return_adv=True)
-    results = []
-    for d, a in devices.values():
-        # Simple filter: check name or if it looks like a Fellow device
-        # The name usually contains "Stagg" or "Fellow"
-        name = d.name or ""
-        if "Stagg" in name or "Fellow" in name or "EKG" in name:
-            results.append({"name": name, "address": d.address, "rssi": a.rssi})
-        # If no specific name, maybe we list everything or let user filter? 
-        # For now, let's just return everything if list is short, 
-        # but to be safe, let's return all, frontend can filter.
-        # Actually, returning all might be noisy. Let's return all for now.
-    
-    # Sort by RSSI
-    results = sorted(results, key=lambda x: x['rssi'], reverse=True)
-    
-    # If we found nothing specific, return top 5 strongest signals
-    if not results:
-         top_devices = sorted(devices.values(), key=lambda x: x[1].rssi, reverse=True)[:5]
-         for d, a in top_devices:
-             results.append({"name": d.name or "Unknown", "address": d.address, "rssi": a.rssi})
+async def scan_devices(wait: float = 5.0):
+    """
+    Return potential Stagg EKG Pro kettles seen by the background scanner.
+    If none has been seen yet, wait up to ``wait`` seconds for one to advertise.
+    """
+    registry = scanner_service.registry
+    # Simple filter: the name usually contains "Stagg", "Fellow" or "EKG"
+    entries = registry.find(name_contains=KETTLE_NAME_HINTS)
+    if not entries and wait > 0:
+        entry = await registry.wait_for(
+            lambda e: any(hint in (e.name or "") for hint in KETTLE_NAME_HINTS), timeout=wait
+        )
+        entries = [entry] if entry else []
 
-    return results
+    # If we found nothing specific, return top 5 strongest signals
+    if not entries:
+        entries = registry.find()[:5]
+
+    return [
+        {"name": e.name or "Unknown", "address": e.address, "rssi": round(e.rssi)}
+        for e in entries
+    ]
+
+async def _drop_kettle():
+    global kettle, reconciler
+    if reconciler:
+        await reconciler.close()
+        reconciler = None
+    if kettle:
+        await kettle.disconnect()
+        kettle = None
 
 @app.post("/api/connect")
 async def connect_device(req: ConnectRequest):
-    global kettle
-    if kettle:
-        await kettle.disconnect()
+    global kettle, reconciler
+    await _drop_kettle()
     
     kettle = StaggEKGPro(req.address)
     connected = await kettle.connect()
@@ -93,15 +105,14 @@ async def connect_device(req: ConnectRequest):
     if not connected:
         kettle = None
         raise HTTPException(status_code=400, detail="Failed to connect to device")
-    
+
+    reconciler = StateReconciler.for_kettle(kettle)
+    reconciler.start()
     return {"status": "connected", "address": req.address}
 
 @app.post("/api/disconnect")
 async def disconnect_device():
-    global kettle
-    if kettle:
-        await kettle.disconnect()
-        kettle = None
+    await _drop_kettle()
     return {"status": "disconnected"}
 
 @app.get("/api/state")
@@ -111,27 +122,23 @@ async def get_state():
         return {"connected": False}
     
     try:
-        # Refresh state to ensure we have latest
-        await kettle.refresh_state()
-        state = kettle.get_all_states()
-        state["connected"] = True
-        return state
+        # Served from the notification-backed cache unless it has gone stale
+        await kettle.ensure_state()
+        return Response(content=kettle.state.to_json(connected=True), media_type="application/json")
     except Exception as e:
         logger.error(f"Error getting state: {e}")
         return {"connected": False, "error": str(e)}
 
 @app.post("/api/temperature")
 async def set_temperature(req: TargetTempRequest):
-    global kettle
-    if not kettle:
+    if not reconciler:
         raise HTTPException(status_code=400, detail="Not connected")
-    await kettle.set_target_temperature(req.temperature)
+    await reconciler.update(target_temp=req.temperature)
     return {"status": "ok", "target": req.temperature}
 
 @app.post("/api/schedule")
 async def set_schedule(req: ScheduleRequest):
-    global kettle
-    if not kettle:
+    if not reconciler:
         raise HTTPException(status_code=400, detail="Not connected")
     
     mode_map = {
@@ -143,20 +150,22 @@ async def set_schedule(req: ScheduleRequest):
     if req.mode not in mode_map:
         raise HTTPException(status_code=400, detail="Invalid schedule mode")
         
-    await kettle.set_schedule(
-        mode=mode_map[req.mode],
-        hour=req.hour,
-        minute=req.minute,
-        temp_celsius=req.temperature
-    )
+    try:
+        await reconciler.update(schedule=Schedule(
+            mode=mode_map[req.mode],
+            hour=req.hour,
+            minute=req.minute,
+            temp_celsius=req.temperature
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {"status": "ok", "schedule": req.dict()}
 
 @app.post("/api/hold")
 async def set_hold(req: HoldRequest):
-    global kettle
-    if not kettle:
+    if not reconciler:
         raise HTTPException(status_code=400, detail="Not connected")
-    await kettle.set_hold_time(req.minutes)
+    await reconciler.update(hold_time=req.minutes)
     return {"status": "ok", "hold_minutes": req.minutes}
 
 if __name__ == "__main__":
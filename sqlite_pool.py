@@ -0,0 +1,182 @@
+"""
+Non-blocking access to an SQLite database from asyncio code.
+
+SQLitePool runs queries on a small dedicated thread pool, each thread
+holding one long-lived connection in WAL mode, so database work never
+blocks the event loop and no connection is opened per query:
+
+    pool = SQLitePool("kettle_oauth.db")
+    row = await pool.fetchone("SELECT user_id FROM tokens WHERE access_token = ?", (token,))
+    await pool.close()
+
+Connections keep a cache of compiled statements keyed by SQL text, so
+queries written as constant strings are prepared once per connection.
+
+GroupCommitWriter puts a single writer task in front of a pool, committing
+queued writes in batches.
+"""
+
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+class SQLitePool:
+    """
+    Args:
+        path: Database file.
+        size: Number of worker threads, and so of connections.
+        busy_timeout: Seconds a writer waits for another connection's write
+            lock before failing.
+        cached_statements: Prepared statements kept per connection.
+    """
+
+    def __init__(self, path: str, size: int = 2, busy_timeout: float = 5.0, cached_statements: int = 64):
+        self.path = path
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        """This worker thread's connection, opened on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Only ever used by this thread; close() runs after the workers have stopped
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                                   cached_statements=self.cached_statements, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _call(self, fn: Callable, args: tuple):
+        conn = self._connection()
+        with conn:  # Commits on success, rolls back on error
+            return fn(conn, *args)
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Run ``fn(connection, *args)`` on a worker thread, in one transaction."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="sqlite")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._call, fn, args)
+
+    async def execute(self, sql: str, params: tuple = ()) -> int:
+        """Run a statement; returns the number of rows changed."""
+        return await self.run(lambda conn: conn.execute(sql, params).rowcount)
+
+    async def fetchone(self, sql: str, params: tuple = ()) -> Optional[tuple]:
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params: tuple = ()) -> list[tuple]:
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def close(self):
+        """Wait for pending queries and close the connections. The pool can be used again afterwards."""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+def _apply_batch(conn: sqlite3.Connection, ops: list[tuple[Callable, tuple]]) -> list[tuple[bool, Any]]:
+    """Run each op under its own savepoint, so a failing op doesn't undo the others."""
+    results = []
+    conn.execute("BEGIN")
+    for fn, args in ops:
+        conn.execute("SAVEPOINT op")
+        try:
+            result = fn(conn, *args)
+        except Exception as e:
+            conn.execute("ROLLBACK TO op")
+            results.append((False, e))
+        else:
+            results.append((True, result))
+        conn.execute("RELEASE op")
+    return results
+
+class GroupCommitWriter:
+    """
+    Funnels writes through a single task that applies everything queued so
+    far (up to ``max_batch`` writes) in one transaction, so a burst of
+    writes costs one commit instead of one each and writers never contend
+    for SQLite's write lock.
+
+    Args:
+        pool: Pool whose worker threads run the batches.
+        max_batch: Most writes committed together.
+    """
+
+    def __init__(self, pool: SQLitePool, max_batch: int = 64):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.writes = 0
+        self.batches = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def write(self, fn: Callable[..., Any], *args) -> Any:
+        """Run ``fn(connection, *args)`` in the next group commit and return its result."""
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run(self._queue))
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((fn, args, future))
+        return await future
+
+    async def execute(self, sql: str, params: tuple = ()) -> int:
+        """Run a statement in the next group commit; returns the number of rows changed."""
+        return await self.write(lambda conn: conn.execute(sql, params).rowcount)
+
+    async def _run(self, queue: asyncio.Queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self.max_batch and not queue.empty():
+                item = queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                results = await self.pool.run(_apply_batch, [(fn, args) for fn, args, _ in batch])
+            except Exception as e:  # The transaction itself failed
+                results = [(False, e)] * len(batch)
+            self.batches += 1
+            self.writes += len(batch)
+            for (_, _, future), (ok, value) in zip(batch, results):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            if stop:
+                return
+
+    async def close(self):
+        """Commit the writes already queued, then stop."""
+        if self._task is not None and not self._task.done():
+            self._queue.put_nowait(None)
+            await self._task
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "writes": self.writes,
+            "batches": self.batches,
+            "mean_batch": round(self.writes / self.batches, 2) if self.batches else None,
+        }
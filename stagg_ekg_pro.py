@@ -6,7 +6,13 @@ Fellow Stagg EKG Pro kettle
 """
 
 import asyncio
+import collections
+import functools
+import json
+import random
+import time
 from bleak import BleakClient, BleakError
+from contextlib import asynccontextmanager
 from enum import Enum
 from typing import Optional, Callable
 import logging
@@ -74,24 +80,574 @@ class Language(Enum):
     SIMPLIFIED_CHINESE = 0x03
     TRADITIONAL_CHINESE = 0x04
 
+def _disable_schedule_payload(data: bytearray) -> bytearray:
+    """Return a copy of ``data`` with the schedule cleared."""
+    new_data = bytearray(data)
+    new_data[_Payload.STATUS_FLAGS] &= ~_StatusFlags.SCHEDULE_ENABLED
+    new_data[_Payload.SCHEDULE_TEMP] = 0xc0
+    new_data[_Payload.SCHEDULE_HOURS] = 0
+    new_data[_Payload.SCHEDULE_MINUTES] = 0
+    return new_data
+
+def _next_counter(counter: int, current: int) -> int:
+    """
+    The counter byte for the next write. The byte also carries the schedule
+    mode flag, so counting skips that bit and the flag of ``current`` (the
+    payload being written) is kept.
+    """
+    flag = _CounterFlags.SCHEDULE_MODE
+    count = (counter & ~flag) + 1
+    if count & flag:
+        count += flag  # Carry past the flag bit
+    return (count & ~flag & 0xFF) | (current & flag)
+
+def _schedule_mode_of(data: bytearray) -> ScheduleMode:
+    """Decode the schedule mode from a payload."""
+    if not (data[_Payload.STATUS_FLAGS] & _StatusFlags.SCHEDULE_ENABLED):
+        return ScheduleMode.OFF
+    return ScheduleMode.ONCE if data[_Payload.COUNTER] & _CounterFlags.SCHEDULE_MODE else ScheduleMode.DAILY
+
+class KettleState:
+    """
+    Immutable, decoded snapshot of a 17-byte payload.
+    Snapshots are memoized per distinct payload (which includes the counter),
+    so repeated polls between notifications reuse the same object.
+    """
+    __slots__ = (
+        'raw', 'counter', 'target_temperature', 'units', 'pre_boil_enabled',
+        'altitude_meters', 'clock_mode', 'clock_hours', 'clock_minutes',
+        'hold_time_minutes', 'chime_volume', 'schedule_mode',
+        'schedule_temperature', 'schedule_hour', 'schedule_minute',
+        'language', '_dict', '_json',
+    )
+
+    def __init__(self, raw: bytes):
+        if len(raw) < 17:
+            raise ValueError("Payload must be 17 bytes.")
+        raw = bytes(raw)
+        control = raw[_Payload.CONTROL_FLAGS]
+        altitude = ((raw[_Payload.ALTITUDE_HIGH] & 0x7F) << 8) | raw[_Payload.ALTITUDE_LOW]
+        try:
+            clock_mode = ClockMode(raw[_Payload.CLOCK_MODE])
+        except ValueError:
+            clock_mode = None
+        try:
+            language = Language(raw[_Payload.LANGUAGE])
+        except ValueError:
+            language = None
+
+        set_ = object.__setattr__
+        set_(self, 'raw', raw)
+        set_(self, 'counter', raw[_Payload.COUNTER])
+        set_(self, 'target_temperature', raw[_Payload.TARGET_TEMP] / 2.0)
+        set_(self, 'units', Units.CELSIUS if control & _ControlFlags.UNITS else Units.FAHRENHEIT)
+        set_(self, 'pre_boil_enabled', bool(control & _ControlFlags.PRE_BOIL))
+        set_(self, 'altitude_meters', round(altitude / 30) * 30)
+        set_(self, 'clock_mode', clock_mode)
+        set_(self, 'clock_hours', raw[_Payload.CLOCK_HOURS])
+        set_(self, 'clock_minutes', raw[_Payload.CLOCK_MINUTES])
+        set_(self, 'hold_time_minutes', raw[_Payload.HOLD_TIME])
+        set_(self, 'chime_volume', raw[_Payload.CHIME_VOLUME])
+        set_(self, 'schedule_mode', _schedule_mode_of(raw))
+        set_(self, 'schedule_temperature', raw[_Payload.SCHEDULE_TEMP] / 2.0)
+        set_(self, 'schedule_hour', raw[_Payload.SCHEDULE_HOURS])
+        set_(self, 'schedule_minute', raw[_Payload.SCHEDULE_MINUTES])
+        set_(self, 'language', language)
+        set_(self, '_dict', self._build_dict())
+        set_(self, '_json', None)
+
+    @classmethod
+    def from_payload(cls, data: bytes) -> 'KettleState':
+        """Decode a payload, reusing the snapshot if this exact payload was seen recently."""
+        return _decode_state(bytes(data))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("KettleState is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("KettleState is immutable")
+
+    def __eq__(self, other):
+        return isinstance(other, KettleState) and self.raw == other.raw
+
+    def __hash__(self):
+        return hash(self.raw)
+
+    def __repr__(self):
+        return f"KettleState({self.raw.hex()})"
+
+    @property
+    def schedule(self) -> dict:
+        """The schedule settings as a dictionary."""
+        return dict(self._dict['schedule'])
+
+    def _build_dict(self) -> dict:
+        if self.schedule_mode == ScheduleMode.OFF:
+            schedule = {'mode': 'off', 'enabled': False}
+        else:
+            schedule = {
+                'mode': self.schedule_mode.name.lower(),
+                'enabled': True,
+                'temperature_celsius': self.schedule_temperature,
+                'hour': self.schedule_hour,
+                'minute': self.schedule_minute,
+                'time': f"{self.schedule_hour:02d}:{self.schedule_minute:02d}"
+            }
+
+        return {
+            'target_temperature': self.target_temperature,
+            'units': self.units.name.lower(),
+            'pre_boil_enabled': self.pre_boil_enabled,
+            'altitude_meters': self.altitude_meters,
+            'clock_mode': self.clock_mode.name.lower() if self.clock_mode else None,
+            'clock_hours': self.clock_hours,
+            'clock_minutes': self.clock_minutes,
+            'clock_time': f"{self.clock_hours:02d}:{self.clock_minutes:02d}",
+            'hold_time_minutes': self.hold_time_minutes,
+            'hold_enabled': self.hold_time_minutes > 0,
+            'chime_volume': self.chime_volume,
+            'chime_enabled': self.chime_volume > 0,
+            'schedule': schedule,
+            'language': self.language.name.title() if self.language else None,
+            'raw_data': self.raw.hex(),
+            'counter': self.counter
+        }
+
+    def to_dict(self) -> dict:
+        """Return the state in the same shape as ``StaggEKGPro.get_all_states()``."""
+        d = dict(self._dict)
+        d['schedule'] = dict(d['schedule'])
+        return d
+
+    def to_json(self, **extra) -> str:
+        """
+        Return the state serialized as JSON.
+        The base document is serialized once per snapshot; ``extra`` keys are
+        appended without re-encoding it.
+        """
+        if self._json is None:
+            object.__setattr__(self, '_json', json.dumps(self._dict))
+        if not extra:
+            return self._json
+        return self._json[:-1] + ", " + json.dumps(extra)[1:]
+
+@functools.lru_cache(maxsize=256)
+def _decode_state(raw: bytes) -> KettleState:
+    return KettleState(raw)
+
+# Payload bytes (and the bits within them) that each KettleState.to_dict() key is decoded from.
+# 'raw_data' and 'counter' are left out: the counter moves with every write, so
+# an echo that only bumps it is not a change.
+_FIELD_BYTES = {
+    'target_temperature': ((_Payload.TARGET_TEMP, 0xFF),),
+    'units': ((_Payload.CONTROL_FLAGS, _ControlFlags.UNITS),),
+    'pre_boil_enabled': ((_Payload.CONTROL_FLAGS, _ControlFlags.PRE_BOIL),),
+    'altitude_meters': ((_Payload.ALTITUDE_LOW, 0xFF), (_Payload.ALTITUDE_HIGH, 0x7F)),
+    'clock_mode': ((_Payload.CLOCK_MODE, 0xFF),),
+    'clock_hours': ((_Payload.CLOCK_HOURS, 0xFF),),
+    'clock_minutes': ((_Payload.CLOCK_MINUTES, 0xFF),),
+    'clock_time': ((_Payload.CLOCK_HOURS, 0xFF), (_Payload.CLOCK_MINUTES, 0xFF)),
+    'hold_time_minutes': ((_Payload.HOLD_TIME, 0xFF),),
+    'hold_enabled': ((_Payload.HOLD_TIME, 0xFF),),
+    'chime_volume': ((_Payload.CHIME_VOLUME, 0xFF),),
+    'chime_enabled': ((_Payload.CHIME_VOLUME, 0xFF),),
+    'schedule': (
+        (_Payload.STATUS_FLAGS, _StatusFlags.SCHEDULE_ENABLED),
+        (_Payload.SCHEDULE_TEMP, 0xFF),
+        (_Payload.SCHEDULE_HOURS, 0xFF),
+        (_Payload.SCHEDULE_MINUTES, 0xFF),
+        (_Payload.COUNTER, _CounterFlags.SCHEDULE_MODE),
+    ),
+    'language': ((_Payload.LANGUAGE, 0xFF),),
+}
+
+# Inverse index: payload offset -> ((mask, field), ...)
+_BYTE_FIELDS = [tuple((mask, field) for field, spans in _FIELD_BYTES.items()
+                      for offset, mask in spans if offset == i)
+                for i in range(17)]
+
+def diff_states(old: Optional[KettleState], new: KettleState) -> frozenset[str]:
+    """
+    Return the logical fields that differ between two snapshots.
+    Changed bytes select candidate fields, which are then confirmed on their
+    decoded values (so e.g. schedule bytes changing while it is off, or an
+    altitude change lost to quantization, are not reported).
+    """
+    if old is None:
+        return frozenset(_FIELD_BYTES)
+
+    candidates = set()
+    for offset, (a, b) in enumerate(zip(old.raw, new.raw)):
+        flipped = a ^ b
+        if flipped:
+            for mask, field in _BYTE_FIELDS[offset]:
+                if flipped & mask:
+                    candidates.add(field)
+    return frozenset(f for f in candidates if old._dict[f] != new._dict[f])
+
+class StateChange:
+    """A compact change event: the fields that changed between two snapshots."""
+    __slots__ = ('previous', 'state', 'changed')
+
+    def __init__(self, previous: Optional[KettleState], state: KettleState, changed: frozenset[str]):
+        self.previous = previous
+        self.state = state
+        self.changed = changed
+
+    def merge(self, newer: 'StateChange') -> 'StateChange':
+        """Collapse this change and a later one into a single change."""
+        return StateChange(self.previous, newer.state, diff_states(self.previous, newer.state))
+
+    def to_dict(self) -> dict:
+        """Return only the changed keys of ``KettleState.to_dict()``."""
+        d = {f: self.state._dict[f] for f in self.changed}
+        if 'schedule' in d:
+            d['schedule'] = dict(d['schedule'])
+        return d
+
+    def __repr__(self):
+        return f"StateChange({sorted(self.changed)})"
+
+class KettleTransaction:
+    """
+    Accumulates field changes on a copy of the kettle payload.
+    Obtained from ``StaggEKGPro.transaction()``; every change made inside the
+    ``async with`` block is committed with a single BLE write on exit.
+    """
+
+    def __init__(self, data: bytearray):
+        self._base = bytes(data)
+        self._data = bytearray(data)
+        self._dirty = False
+        self._schedule_mode_change = False
+
+    def _set(self, offset: int, value: int):
+        self._data[offset] = value
+        self._dirty = True
+
+    def _set_flag(self, offset: int, mask: int, enabled: bool):
+        if enabled:
+            self._data[offset] |= mask
+        else:
+            self._data[offset] &= ~mask
+        self._dirty = True
+
+    @property
+    def payload(self) -> bytearray:
+        """The composed payload (counter is assigned at commit time)."""
+        return bytearray(self._data)
+
+    @property
+    def dirty(self) -> bool:
+        """True if any field has been assigned."""
+        return self._dirty
+
+    @property
+    def changed(self) -> bool:
+        """True if the assignments changed the payload."""
+        return self._dirty and self._data != self._base
+
+    @property
+    def target_temp(self) -> float:
+        return self._data[_Payload.TARGET_TEMP] / 2.0
+
+    @target_temp.setter
+    def target_temp(self, temp_celsius: float):
+        temp_celsius = max(0, min(100, temp_celsius))
+        self._set(_Payload.TARGET_TEMP, int(temp_celsius * 2))
+
+    @property
+    def units(self) -> Units:
+        return Units.CELSIUS if self._data[_Payload.CONTROL_FLAGS] & _ControlFlags.UNITS else Units.FAHRENHEIT
+
+    @units.setter
+    def units(self, units: Units):
+        self._set_flag(_Payload.CONTROL_FLAGS, _ControlFlags.UNITS, units == Units.CELSIUS)
+
+    @property
+    def pre_boil(self) -> bool:
+        return bool(self._data[_Payload.CONTROL_FLAGS] & _ControlFlags.PRE_BOIL)
+
+    @pre_boil.setter
+    def pre_boil(self, enabled: bool):
+        self._set_flag(_Payload.CONTROL_FLAGS, _ControlFlags.PRE_BOIL, enabled)
+
+    @property
+    def clock_mode(self) -> Optional[ClockMode]:
+        try:
+            return ClockMode(self._data[_Payload.CLOCK_MODE])
+        except ValueError:
+            return None
+
+    @clock_mode.setter
+    def clock_mode(self, mode: ClockMode):
+        self._set(_Payload.CLOCK_MODE, mode.value)
+
+    def set_clock_time(self, hours: int, minutes: int):
+        """Set the clock time."""
+        if not (0 <= hours <= 23 and 0 <= minutes <= 59):
+            raise ValueError("Invalid time provided.")
+        self._set(_Payload.CLOCK_MINUTES, minutes)
+        self._set(_Payload.CLOCK_HOURS, hours)
+
+    @property
+    def chime_volume(self) -> int:
+        return self._data[_Payload.CHIME_VOLUME]
+
+    @chime_volume.setter
+    def chime_volume(self, volume: int):
+        self._set(_Payload.CHIME_VOLUME, max(0, min(10, volume)))
+
+    @property
+    def hold_time(self) -> int:
+        return self._data[_Payload.HOLD_TIME]
+
+    @hold_time.setter
+    def hold_time(self, minutes: int):
+        self._set(_Payload.HOLD_TIME, max(0, min(60, minutes)))
+
+    @property
+    def altitude(self) -> int:
+        altitude = ((self._data[_Payload.ALTITUDE_HIGH] & 0x7F) << 8) | self._data[_Payload.ALTITUDE_LOW]
+        return round(altitude / 30) * 30
+
+    @altitude.setter
+    def altitude(self, altitude_meters: int):
+        altitude_meters = max(0, min(3000, altitude_meters))
+        quantized = round(altitude_meters / 30) * 30
+        self._set(_Payload.ALTITUDE_LOW, quantized & 0xFF)
+        self._set(_Payload.ALTITUDE_HIGH, 0x80 + ((quantized >> 8) & 0x7F))
+
+    @property
+    def language(self) -> Optional[Language]:
+        try:
+            return Language(self._data[_Payload.LANGUAGE])
+        except ValueError:
+            return None
+
+    @language.setter
+    def language(self, language: Language):
+        if not isinstance(language, Language):
+            raise ValueError("Invalid language specified.")
+        self._set(_Payload.LANGUAGE, language.value)
+
+    @property
+    def schedule_mode(self) -> ScheduleMode:
+        return _schedule_mode_of(self._data)
+
+    def set_schedule(self, mode: ScheduleMode, hour: int = 0, minute: int = 0, temp_celsius: float = 85):
+        """
+        Set the schedule mode, time, and temperature.
+        A change between ONCE and DAILY is committed as a two-step write;
+        only the last call in a transaction decides whether one is needed.
+        """
+        if mode == ScheduleMode.OFF:
+            self._data = _disable_schedule_payload(self._data)
+            self._dirty = True
+            self._schedule_mode_change = False  # Disabling is a single write
+            return
+
+        if not (0 <= hour <= 23 and 0 <= minute <= 59):
+            raise ValueError("Invalid time provided for schedule.")
+        temp_celsius = max(0, min(100, temp_celsius))
+
+        base_mode = _schedule_mode_of(bytearray(self._base))
+        self._schedule_mode_change = base_mode != ScheduleMode.OFF and base_mode != mode
+
+        self._set_flag(_Payload.STATUS_FLAGS, _StatusFlags.SCHEDULE_ENABLED, True)
+        self._set(_Payload.SCHEDULE_TEMP, int(temp_celsius * 2))
+        self._set(_Payload.SCHEDULE_HOURS, hour)
+        self._set(_Payload.SCHEDULE_MINUTES, minute)
+        self._set_flag(_Payload.COUNTER, _CounterFlags.SCHEDULE_MODE, mode == ScheduleMode.ONCE)
+
+class OverflowPolicy(Enum):
+    """What a subscription does when its queue is full"""
+    DROP_OLDEST = "drop_oldest"  # Discard the oldest queued update
+    COALESCE = "coalesce"        # Keep only the latest update
+    BLOCK = "block"              # Hold back delivery until the consumer catches up
+
+class Subscription:
+    """
+    A bounded queue of kettle updates, consumed as an async iterator.
+    Obtained from ``StaggEKGPro.subscribe()``.
+    """
+
+    def __init__(self, hub: 'NotificationHub', maxsize: int, policy: OverflowPolicy):
+        self._hub = hub
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.dropped = 0
+        self._items = collections.deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._closed = False
+
+    def _offer(self, item) -> bool:
+        """Enqueue without waiting. Returns False if a BLOCK subscription is full."""
+        if self.policy == OverflowPolicy.COALESCE:
+            if self._items:
+                merge = getattr(self._items[-1], 'merge', None)
+                if merge is not None:
+                    item = merge(item)
+            self.dropped += len(self._items)
+            self._items.clear()
+        elif len(self._items) >= self.maxsize:
+            if self.policy == OverflowPolicy.BLOCK:
+                return False
+            self._items.popleft()
+            self.dropped += 1
+        self._items.append(item)
+        self._not_empty.set()
+        return True
+
+    async def _put(self, item):
+        while not self._closed and not self._offer(item):
+            self._not_full.clear()
+            await self._not_full.wait()
+
+    async def get(self):
+        """Wait for the next update. Raises StopAsyncIteration once closed and drained."""
+        while not self._items:
+            if self._closed:
+                raise StopAsyncIteration
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        item = self._items.popleft()
+        self._not_full.set()
+        return item
+
+    def close(self):
+        """Stop receiving updates. Already queued updates can still be consumed."""
+        if not self._closed:
+            self._closed = True
+            self._hub._unsubscribe(self)
+            self._not_empty.set()
+            self._not_full.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+class NotificationHub:
+    """
+    Fans kettle updates out to any number of subscriptions.
+    publish() only queues the update, so it never adds latency to the BLE
+    notification handler; a dispatcher task delivers it to each subscription
+    according to its overflow policy. A full BLOCK subscription holds back
+    the dispatcher, and with it delivery to the other subscribers; updates
+    published meanwhile are merged into one (a state stream only needs the
+    newest state), and at most ``max_pending`` unmergeable ones are kept.
+    """
+
+    def __init__(self, max_pending: int = 64):
+        self._subscribers: list[Subscription] = []
+        self._pending = collections.deque(maxlen=max(1, max_pending))
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    @property
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    def subscribe(self, maxsize: int = 16, policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST) -> Subscription:
+        sub = Subscription(self, maxsize, policy)
+        self._subscribers.append(sub)
+        return sub
+
+    def _unsubscribe(self, sub: Subscription):
+        if sub in self._subscribers:
+            self._subscribers.remove(sub)
+
+    def publish(self, item):
+        """Queue an update for delivery to every subscription."""
+        if not self._subscribers:
+            return
+        merge = getattr(self._pending[-1], 'merge', None) if self._pending else None
+        if merge is not None:
+            item = merge(item)
+            self._pending.pop()
+            if not getattr(item, 'changed', True):
+                return  # Back where the queued update started from
+        self._pending.append(item)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def _dispatch(self):
+        while self._pending:
+            item = self._pending.popleft()
+            for sub in list(self._subscribers):
+                await sub._put(item)
+
 class StaggEKGPro:
     """
     Fellow Stagg EKG Pro Controller
     This class handles the BLE communication and control of the kettle.
     """
     
-    def __init__(self, address: str):
+    def __init__(self, address: str, max_staleness: float = 30.0,
+                 confirm_writes: bool = False, write_timeout: float = 1.0,
+                 write_retries: int = 2, write_with_response: bool = True,
+                 hub: Optional[NotificationHub] = None,
+                 client_factory: Optional[Callable[..., BleakClient]] = None,
+                 auto_reconnect: bool = True, reconnect_delay: float = 0.5,
+                 max_reconnect_delay: float = 30.0):
         """
         Initialize the Stagg EKG Pro controller.
         
         Args:
             address: BLE MAC address or UUID of the kettle.
+            max_staleness: Seconds a cached state (from a read, write or
+                notification) is served by ensure_state() before it is
+                re-read from the kettle.
+            confirm_writes: Wait for the kettle to echo each written payload
+                back as a notification before a write completes.
+            write_timeout: Seconds to wait for that echo per attempt.
+            write_retries: Times an unacknowledged write is re-sent.
+            write_with_response: Use ATT write requests. Disabling this
+                together with confirm_writes gives a write-without-response
+                fast path that still detects lost writes.
+            hub: Notification hub to publish state updates to. Share one
+                between instances to keep subscriptions across reconnects.
+            client_factory: Called with the address to create the BLE client
+                (defaults to BleakClient), e.g. to record or replay traffic.
+            auto_reconnect: Reconnect in the background when the link drops
+                (but not after disconnect()), re-subscribing to notifications
+                and re-reading the state; see ready().
+            reconnect_delay: Delay before the first reconnect attempt,
+                doubled after each failure up to max_reconnect_delay and
+                jittered so several kettles don't retry in lockstep.
         """
         self.address = address
+        self.max_staleness = max_staleness
+        self.confirm_writes = confirm_writes
+        self.write_timeout = write_timeout
+        self.write_retries = write_retries
+        self.write_with_response = write_with_response
+        self.hub = hub if hub is not None else NotificationHub()
+        self.client_factory = client_factory
+        self.auto_reconnect = auto_reconnect
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
         self.client: Optional[BleakClient] = None
         self._state_data: Optional[bytearray] = None
+        self._state_updated_at: Optional[float] = None
+        self._snapshot: Optional[KettleState] = None
+        self._published: Optional[KettleState] = None
         self._notification_callback: Optional[Callable] = None
         self._counter: int = 0
+        self._pending_echoes: dict[int, asyncio.Future] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+        self._closing = False
+        self._link = 0
+        self._reconnect_task: Optional[asyncio.Task] = None
         
     async def connect(self) -> bool:
         """
@@ -100,102 +656,315 @@ class StaggEKGPro:
         Returns:
             True if connected successfully, False otherwise.
         """
+        self._closing = False
+        self._cancel_reconnect()
         try:
-            self.client = BleakClient(self.address)
-            await self.client.connect()
-            
-            if self.client.is_connected:
-                logger.info(f"✅ Connected to Stagg EKG Pro at {self.address}")
-                await self.client.start_notify(MAIN_CONFIG_UUID, self._handle_notification)
-                await self.refresh_state()
-                return True
-            return False
+            return await self._establish()
         except BleakError as e:
             logger.error(f"❌ Connection failed: {e}")
             return False
+
+    async def _establish(self) -> bool:
+        """Open a new link, subscribe to notifications and read the state."""
+        self._link += 1
+        link = self._link
+        self.client = (self.client_factory or BleakClient)(
+            self.address, disconnected_callback=lambda _client: self._on_link_lost(link)
+        )
+        # Anything cached from a previous link may be out of date
+        self._state_updated_at = None
+        await self.client.connect()
+
+        if self.client.is_connected:
+            logger.info(f"✅ Connected to Stagg EKG Pro at {self.address}")
+            try:
+                await self.client.start_notify(MAIN_CONFIG_UUID, self._handle_notification)
+                await self.refresh_state()
+            except BaseException:
+                # Don't leave a half-set-up link open behind the next attempt
+                self._link += 1  # Its disconnect isn't a lost link to recover
+                try:
+                    await self.client.disconnect()
+                except Exception as e:
+                    logger.debug(f"Disconnect after failed setup failed: {e!r}")
+                raise
+            self._ready.set()
+            return True
+        return False
+
+    def _on_link_lost(self, link: int):
+        """Disconnected callback of the client created for ``link``."""
+        if link != self._link or self._closing:
+            return  # A replaced link, or a disconnect we asked for
+        logger.warning(f"⚠️ Lost connection to kettle at {self.address}")
+        self._ready.clear()
+        self._state_updated_at = None
+        if self.auto_reconnect and (self._reconnect_task is None or self._reconnect_task.done()):
+            self._reconnect_task = asyncio.create_task(self._reconnect_loop())
+
+    async def _reconnect_loop(self):
+        delay = self.reconnect_delay
+        while not self._closing:
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            try:
+                if await self._establish():
+                    logger.info(f"🔄 Reconnected to kettle at {self.address}")
+                    return
+            except Exception as e:
+                # E.g. the link dropping again mid-setup; keep trying
+                logger.debug(f"Reconnect attempt failed: {e!r}")
+            delay = min(self.max_reconnect_delay, delay * 2)
+
+    def _cancel_reconnect(self):
+        if self._reconnect_task and not self._reconnect_task.done():
+            if self._reconnect_task is not asyncio.current_task():
+                self._reconnect_task.cancel()
+        self._reconnect_task = None
+
+    @property
+    def reconnecting(self) -> bool:
+        """True while a background reconnect is in progress."""
+        return self._reconnect_task is not None and not self._reconnect_task.done()
+
+    @property
+    def is_ready(self) -> bool:
+        """True if the link is up and the state has been read over it."""
+        return self._ready.is_set() and bool(self.client and self.client.is_connected)
+
+    async def ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the link is up and the state has been synced, e.g. while
+        a background reconnect runs. Returns False if ``timeout`` passes first.
+        """
+        if self.is_ready:
+            return True
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return self.is_ready
     
     async def disconnect(self):
         """Disconnect from the kettle."""
+        self._closing = True
+        self._cancel_reconnect()
+        self._ready.clear()
+        self._state_updated_at = None
         if self.client and self.client.is_connected:
             await self.client.disconnect()
             logger.info("🔌 Disconnected from kettle")
+
+    def _set_state(self, data: bytearray):
+        """Store a payload read from, written to or notified by the kettle."""
+        self._state_data = bytearray(data)
+        self._counter = data[_Payload.COUNTER]
+        self._state_updated_at = time.monotonic()
+        self._snapshot = None
+        if self.hub.has_subscribers:
+            state = self.state
+            changed = diff_states(self._published, state)
+            if changed:
+                self.hub.publish(StateChange(self._published, state, changed))
+            self._published = state
+        else:
+            self._published = None
     
     def _handle_notification(self, sender, data: bytearray):
         """Handle incoming BLE notifications."""
-        self._state_data = bytearray(data)
-        self._counter = data[_Payload.COUNTER]
+        self._set_state(data)
         logger.debug(f"📡 Notification received: {data.hex()}")
+        echo = self._pending_echoes.pop(data[_Payload.COUNTER], None)
+        if echo and not echo.done():
+            echo.set_result(bytes(data))
         if self._notification_callback:
             self._notification_callback(self.get_all_states())
     
     def set_notification_callback(self, callback: Callable):
-        """Set a callback for settings updates."""
+        """
+        Set a callback for settings updates.
+        The callback runs inline in the BLE notification handler; prefer
+        subscribe() for anything slow.
+        """
         self._notification_callback = callback
+
+    def subscribe(self, maxsize: int = 16, policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST) -> Subscription:
+        """
+        Subscribe to state updates.
+
+        Usage:
+            async with kettle.subscribe(policy=OverflowPolicy.COALESCE) as updates:
+                async for state in updates:
+                    ...
+
+        Each update is a StateChange naming the fields that changed; payloads
+        that change nothing are not published, and ``kettle.state`` gives the
+        full snapshot to start from. Updates are queued per subscriber (up to
+        ``maxsize``) and ``policy`` decides what happens when the queue is
+        full; COALESCE merges pending changes into one.
+        """
+        return self.hub.subscribe(maxsize, policy)
     
     async def refresh_state(self):
-        """Read the current state from the kettle."""
+        """
+        Read the current state from the kettle.
+        Calls made while a read is already in flight wait for that read
+        instead of issuing another one.
+        """
         if not self.client or not self.client.is_connected:
             raise RuntimeError("Not connected to kettle")
-        
+
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(self._read_state())
+            self._refresh_task.add_done_callback(self._refresh_done)
+        # Shielded so a cancelled caller does not abort the read for the others
+        await asyncio.shield(self._refresh_task)
+
+    async def _read_state(self):
         data = await self.client.read_gatt_char(MAIN_CONFIG_UUID)
-        self._state_data = bytearray(data)
-        self._counter = data[_Payload.COUNTER]
+        self._set_state(data)
         logger.debug(f"📊 State refreshed: {data.hex()}")
+
+    def _refresh_done(self, task: asyncio.Task):
+        self._refresh_task = None
+        if not task.cancelled():
+            task.exception()  # Retrieved here in case every caller was cancelled
+
+    @property
+    def state_age(self) -> Optional[float]:
+        """Seconds since the cached state was last updated, or None if there is none."""
+        if self._state_data is None or self._state_updated_at is None:
+            return None
+        return time.monotonic() - self._state_updated_at
+
+    async def ensure_state(self, max_age: Optional[float] = None):
+        """
+        Make sure the cached state is fresh, reading it from the kettle only if needed.
+
+        Notifications and writes keep the cache current, so this only falls
+        back to a GATT read when the cache is older than ``max_age`` (defaults
+        to ``max_staleness``) or the link has been re-established.
+        """
+        if not self.client or not self.client.is_connected:
+            raise RuntimeError("Not connected to kettle")
+
+        age = self.state_age
+        if age is None or age > (self.max_staleness if max_age is None else max_age):
+            await self.refresh_state()
     
+    @property
+    def state(self) -> Optional[KettleState]:
+        """The decoded snapshot of the cached payload, or None if there is none."""
+        if self._snapshot is None:
+            if not self._state_data or len(self._state_data) < 17:
+                return None
+            self._snapshot = KettleState.from_payload(self._state_data)
+        return self._snapshot
+
     def get_all_states(self) -> dict:
         """
         Get a dictionary of all current kettle states.
         """
-        if not self._state_data or len(self._state_data) < 17:
-            return {}
-        
-        clock_hours, clock_minutes = self.get_clock_time() or (0,0)
+        state = self.state
+        return state.to_dict() if state else {}
 
-        return {
-            'target_temperature': self.get_target_temperature(),
-            'units': self.get_units().name.lower() if self.get_units() else None,
-            'pre_boil_enabled': self.get_pre_boil(),
-            'altitude_meters': self.get_altitude(),
-            'clock_mode': self.get_clock_mode().name.lower() if self.get_clock_mode() else None,
-            'clock_hours': clock_hours,
-            'clock_minutes': clock_minutes,
-            'clock_time': f"{clock_hours:02d}:{clock_minutes:02d}",
-            'hold_time_minutes': self.get_hold_time(),
-            'hold_enabled': self.get_hold_time() > 0,
-            'chime_volume': self.get_chime_volume(),
-            'chime_enabled': self.get_chime_volume() > 0,
-            'schedule': self.get_schedule(),
-            'language': self.get_language().name.title() if self.get_language() else None,
-            'raw_data': self._state_data.hex(),
-            'counter': self._counter
-        }
+    async def _write_state(self, new_data: bytearray, confirm: Optional[bool] = None,
+                           timeout: Optional[float] = None, retries: Optional[int] = None):
+        """
+        Internal method to write state to the kettle.
 
-    async def _write_state(self, new_data: bytearray):
-        """Internal method to write state to the kettle."""
+        When confirming, the write only completes once a notification carrying
+        the payload's counter arrives. Unacknowledged writes are re-sent up to
+        ``retries`` times before TimeoutError is raised.
+        """
         if not self.client or not self.client.is_connected:
             raise RuntimeError("Not connected to kettle")
+
+        confirm = self.confirm_writes if confirm is None else confirm
+        timeout = self.write_timeout if timeout is None else timeout
+        retries = self.write_retries if retries is None else retries
         
-        new_data[_Payload.COUNTER] = (self._counter + 1) & 0xFF
-        
-        await self.client.write_gatt_char(MAIN_CONFIG_UUID, bytes(new_data))
-        logger.debug(f"✍️ Written: {new_data.hex()}")
+        new_data[_Payload.COUNTER] = _next_counter(self._counter, new_data[_Payload.COUNTER])
+        counter = new_data[_Payload.COUNTER]
+        # Advanced as the payload goes out, so a write whose echo is lost
+        # doesn't leave the next write reusing its counter
+        self._counter = counter
+
+        echo = None
+        if confirm:
+            # Register before writing so an early echo is not missed
+            echo = asyncio.get_running_loop().create_future()
+            self._pending_echoes[counter] = echo
+
+        try:
+            for attempt in range(1 + (retries if confirm else 0)):
+                await self.client.write_gatt_char(MAIN_CONFIG_UUID, bytes(new_data), response=self.write_with_response)
+                logger.debug(f"✍️ Written: {new_data.hex()}")
+                if echo is None:
+                    break
+                try:
+                    await asyncio.wait_for(asyncio.shield(echo), timeout)
+                    break
+                except asyncio.TimeoutError:
+                    logger.warning(f"⚠️ No echo for write {counter} (attempt {attempt + 1})")
+            else:
+                raise TimeoutError(f"Kettle did not acknowledge write {counter}")
+        finally:
+            if echo is not None and self._pending_echoes.get(counter) is echo:
+                del self._pending_echoes[counter]
         
-        self._state_data = new_data
-        self._counter = new_data[_Payload.COUNTER]
+        self._set_state(new_data)
+
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        Compose several field changes into a single BLE write.
+
+        Usage:
+            async with kettle.transaction() as t:
+                t.target_temp = 93
+                t.set_schedule(ScheduleMode.ONCE, 7, 30, 93)
+
+        The payload is written when the block exits without an exception,
+        unless it is unchanged.
+        """
+        await self.ensure_state()
+
+        txn = KettleTransaction(self._state_data)
+        yield txn
+        await self._commit(txn)
+
+    async def _commit(self, txn: KettleTransaction):
+        """
+        Write a transaction's payload, splitting schedule mode changes in two.
+        Nothing is written if the payload would not change.
+        """
+        if not txn.changed:
+            logger.debug("💤 Skipped write, kettle already in the requested state")
+            return
+
+        if txn._schedule_mode_change:
+            # Step 1: Disable schedule first
+            disabled_data = _disable_schedule_payload(self._state_data)
+            if self.confirm_writes:
+                await self._write_state(disabled_data)
+            else:
+                # Proceed as soon as the kettle echoes the change, waiting no
+                # longer than the fixed delay this step used to take
+                try:
+                    await self._write_state(disabled_data, confirm=True, timeout=0.3, retries=0)
+                except TimeoutError:
+                    # Sent but unconfirmed; assume the kettle took it
+                    self._set_state(disabled_data)
+
+        await self._write_state(txn.payload)
     
     # ========== Temperature Control ==========
     
     async def set_target_temperature(self, temp_celsius: float):
         """Set the target temperature in Celsius (0-100)."""
-        if self._state_data is None: await self.refresh_state()
-        
-        temp_celsius = max(0, min(100, temp_celsius))
-        
-        new_data = bytearray(self._state_data)
-        new_data[_Payload.TARGET_TEMP] = int(temp_celsius * 2)
-        
-        await self._write_state(new_data)
-        logger.info(f"🎯 Target temperature set to {temp_celsius}°C")
+        async with self.transaction() as t:
+            t.target_temp = temp_celsius
+        logger.info(f"🎯 Target temperature set to {t.target_temp}°C")
     
     def get_target_temperature(self) -> Optional[float]:
         """Get the current target temperature in Celsius."""
@@ -206,16 +975,8 @@ class StaggEKGPro:
     
     async def set_units(self, units: Units):
         """Set temperature units."""
-        if self._state_data is None: await self.refresh_state()
-        
-        new_data = bytearray(self._state_data)
-        
-        if units == Units.CELSIUS:
-            new_data[_Payload.CONTROL_FLAGS] |= _ControlFlags.UNITS
-        else:
-            new_data[_Payload.CONTROL_FLAGS] &= ~_ControlFlags.UNITS
-        
-        await self._write_state(new_data)
+        async with self.transaction() as t:
+            t.units = units
         logger.info(f"🌐 Units set to {units.name}")
     
     def get_units(self) -> Optional[Units]:
@@ -227,29 +988,16 @@ class StaggEKGPro:
     
     async def set_clock_mode(self, mode: ClockMode):
         """Set the clock display mode."""
-        if self._state_data is None: await self.refresh_state()
-        
-        new_data = bytearray(self._state_data)
-        new_data[_Payload.CLOCK_MODE] = mode.value
-        
-        await self._write_state(new_data)
+        async with self.transaction() as t:
+            t.clock_mode = mode
         logger.info(f"🕐 Clock mode set to {mode.name}")
     
     async def set_clock_time(self, hours: int, minutes: int, mode: Optional[ClockMode] = None):
         """Set the clock time and optionally the display mode."""
-        if self._state_data is None: await self.refresh_state()
-        
-        if not (0 <= hours <= 23 and 0 <= minutes <= 59):
-            raise ValueError("Invalid time provided.")
-        
-        new_data = bytearray(self._state_data)
-        new_data[_Payload.CLOCK_MINUTES] = minutes
-        new_data[_Payload.CLOCK_HOURS] = hours
-        
-        if mode is not None:
-            new_data[_Payload.CLOCK_MODE] = mode.value
-        
-        await self._write_state(new_data)
+        async with self.transaction() as t:
+            t.set_clock_time(hours, minutes)
+            if mode is not None:
+                t.clock_mode = mode
         logger.info(f"🕐 Clock set to {hours:02d}:{minutes:02d}" + (f" ({mode.name})" if mode else ""))
     
     def get_clock_time(self) -> Optional[tuple[int, int]]:
@@ -269,14 +1017,9 @@ class StaggEKGPro:
     
     async def set_chime_volume(self, volume: int):
         """Set the chime volume (0-10)."""
-        if self._state_data is None: await self.refresh_state()
-        
-        volume = max(0, min(10, volume))
-        
-        new_data = bytearray(self._state_data)
-        new_data[_Payload.CHIME_VOLUME] = volume
-        
-        await self._write_state(new_data)
+        async with self.transaction() as t:
+            t.chime_volume = volume
+        volume = t.chime_volume
         logger.info(f"🔔 Chime volume set to {volume}" if volume > 0 else "🔔 Chime disabled")
     
     def get_chime_volume(self) -> Optional[int]:
@@ -288,16 +1031,8 @@ class StaggEKGPro:
     
     async def set_pre_boil(self, enabled: bool):
         """Enable or disable the pre-boil feature."""
-        if self._state_data is None: await self.refresh_state()
-        
-        new_data = bytearray(self._state_data)
-        
-        if enabled:
-            new_data[_Payload.CONTROL_FLAGS] |= _ControlFlags.PRE_BOIL
-        else:
-            new_data[_Payload.CONTROL_FLAGS] &= ~_ControlFlags.PRE_BOIL
-        
-        await self._write_state(new_data)
+        async with self.transaction() as t:
+            t.pre_boil = enabled
         logger.info(f"🔥 Pre-boil {'enabled' if enabled else 'disabled'}")
     
     def get_pre_boil(self) -> Optional[bool]:
@@ -309,14 +1044,9 @@ class StaggEKGPro:
     
     async def set_hold_time(self, minutes: int):
         """Set hold temperature time in minutes (0=OFF, 15, 30, 45, 60)."""
-        if self._state_data is None: await self.refresh_state()
-        
-        minutes = max(0, min(60, minutes))
-        
-        new_data = bytearray(self._state_data)
-        new_data[_Payload.HOLD_TIME] = minutes
-        
-        await self._write_state(new_data)
+        async with self.transaction() as t:
+            t.hold_time = minutes
+        minutes = t.hold_time
         logger.info(f"⏱️ Hold time set to {minutes} minutes" if minutes > 0 else "⏱️ Hold mode disabled")
     
     def get_hold_time(self) -> Optional[int]:
@@ -328,20 +1058,9 @@ class StaggEKGPro:
     
     async def set_altitude(self, altitude_meters: int):
         """Set altitude compensation in meters (0-3000)."""
-        if self._state_data is None: await self.refresh_state()
-        
-        altitude_meters = max(0, min(3000, altitude_meters))
-        quantized = round(altitude_meters / 30) * 30
-        
-        byte_low = quantized & 0xFF
-        byte_high = 0x80 + ((quantized >> 8) & 0x7F)
-        
-        new_data = bytearray(self._state_data)
-        new_data[_Payload.ALTITUDE_LOW] = byte_low
-        new_data[_Payload.ALTITUDE_HIGH] = byte_high
-        
-        await self._write_state(new_data)
-        logger.info(f"🏔️ Altitude set to {quantized}m")
+        async with self.transaction() as t:
+            t.altitude = altitude_meters
+        logger.info(f"🏔️ Altitude set to {t.altitude}m")
     
     def get_altitude(self) -> Optional[int]:
         """Get the current altitude compensation in meters."""
@@ -357,54 +1076,20 @@ class StaggEKGPro:
 
     async def _disable_schedule(self, old_data: bytearray) -> bytearray:
         """Helper to create a schedule-disabled payload."""
-        new_data = bytearray(old_data)
-        new_data[_Payload.STATUS_FLAGS] &= ~_StatusFlags.SCHEDULE_ENABLED
-        new_data[_Payload.SCHEDULE_TEMP] = 0xc0
-        new_data[_Payload.SCHEDULE_HOURS] = 0
-        new_data[_Payload.SCHEDULE_MINUTES] = 0
-        return new_data
+        return _disable_schedule_payload(old_data)
 
     async def set_schedule(self, mode: ScheduleMode, hour: int = 0, minute: int = 0, temp_celsius: float = 85):
         """
         Set the schedule mode, time, and temperature.
         Note: Changing between ONCE and DAILY requires a two-step BLE write.
         """
-        if self._state_data is None: await self.refresh_state()
+        async with self.transaction() as t:
+            t.set_schedule(mode, hour, minute, temp_celsius)
 
         if mode == ScheduleMode.OFF:
-            new_data = await self._disable_schedule(self._state_data)
-            await self._write_state(new_data)
             logger.info("📅 Schedule disabled")
-            return
-
-        if not (0 <= hour <= 23 and 0 <= minute <= 59):
-            raise ValueError("Invalid time provided for schedule.")
-        temp_celsius = max(0, min(100, temp_celsius))
-
-        current_mode = self.get_schedule_mode()
-        is_mode_change = current_mode not in (ScheduleMode.OFF, None) and current_mode != mode
-
-        if is_mode_change:
-            # Step 1: Disable schedule first
-            disabled_data = await self._disable_schedule(self._state_data)
-            await self._write_state(disabled_data)
-            await asyncio.sleep(0.3)  # Allow kettle to process the change
-
-        # Step 2: Set the new schedule
-        new_data = bytearray(self._state_data)
-        new_data[_Payload.STATUS_FLAGS] |= _StatusFlags.SCHEDULE_ENABLED
-        new_data[_Payload.SCHEDULE_TEMP] = int(temp_celsius * 2)
-        new_data[_Payload.SCHEDULE_HOURS] = hour
-        new_data[_Payload.SCHEDULE_MINUTES] = minute
-
-        # Set schedule mode bit
-        if mode == ScheduleMode.ONCE:
-            new_data[_Payload.COUNTER] |= _CounterFlags.SCHEDULE_MODE
-        else: # DAILY
-            new_data[_Payload.COUNTER] &= ~_CounterFlags.SCHEDULE_MODE
-
-        await self._write_state(new_data)
-        logger.info(f"📅 Schedule set to {mode.name} at {hour:02d}:{minute:02d}, {temp_celsius}°C")
+        else:
+            logger.info(f"📅 Schedule set to {mode.name} at {hour:02d}:{minute:02d}, {max(0, min(100, temp_celsius))}°C")
 
 
     def get_schedule(self) -> dict:
@@ -432,23 +1117,14 @@ class StaggEKGPro:
     def get_schedule_mode(self) -> Optional[ScheduleMode]:
         """Get the current schedule mode."""
         if self._state_data is None: return None
-        if not (self._state_data[_Payload.STATUS_FLAGS] & _StatusFlags.SCHEDULE_ENABLED):
-            return ScheduleMode.OFF
-        
-        is_once = self._state_data[_Payload.COUNTER] & _CounterFlags.SCHEDULE_MODE
-        return ScheduleMode.ONCE if is_once else ScheduleMode.DAILY
+        return _schedule_mode_of(self._state_data)
 
     # ========== Language Control ==========
 
     async def set_language(self, language: Language):
         """Set the kettle's language."""
-        if self._state_data is None: await self.refresh_state()
-        if not isinstance(language, Language):
-            raise ValueError("Invalid language specified.")
-
-        new_data = bytearray(self._state_data)
-        new_data[_Payload.LANGUAGE] = language.value
-        await self._write_state(new_data)
+        async with self.transaction() as t:
+            t.language = language
         logger.info(f"🌐 Language set to {language.name.title()}")
 
     def get_language(self) -> Optional[Language]:
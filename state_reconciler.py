@@ -0,0 +1,242 @@
+"""
+Desired-state control of a Stagg EKG Pro.
+
+Instead of issuing writes, callers declare the settings they want and the
+reconciler works out whether the kettle needs a write at all:
+
+    reconciler = StateReconciler.for_kettle(kettle)
+    reconciler.start()
+    await reconciler.update(target_temp=93, hold_time=15)
+
+Settings that already match the cached payload cost no write, changes
+declared in quick succession are merged into one write of the latest
+values, and a notification showing that an applied setting drifted (e.g. a
+write the kettle lost) has it written again.
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncContextManager, Callable, NamedTuple, Optional
+
+from stagg_ekg_pro import (
+    KettleState, KettleTransaction, NotificationHub, OverflowPolicy, ScheduleMode, StaggEKGPro,
+)
+
+# KettleTransaction attributes a desired state can set; the clock is left
+# out since it moves on by itself
+FIELDS = frozenset({
+    'target_temp', 'units', 'pre_boil', 'clock_mode', 'chime_volume',
+    'hold_time', 'altitude', 'language', 'schedule',
+})
+
+class Schedule(NamedTuple):
+    """Desired value of the ``schedule`` field."""
+    mode: ScheduleMode
+    hour: int = 0
+    minute: int = 0
+    temp_celsius: float = 85
+
+def stage(txn: KettleTransaction, desired: dict):
+    """Set every desired field on a transaction."""
+    for field, value in desired.items():
+        if field == 'schedule':
+            # A disabled schedule leaves stale time and temperature bytes, which don't matter
+            if value.mode == ScheduleMode.OFF and txn.schedule_mode == ScheduleMode.OFF:
+                continue
+            txn.set_schedule(*value)
+        else:
+            setattr(txn, field, value)
+
+def needs_write(payload: bytes, desired: dict) -> bool:
+    """True if the kettle's ``payload`` differs from the desired fields."""
+    txn = KettleTransaction(bytearray(payload))
+    stage(txn, desired)
+    return txn.changed
+
+class StateReconciler:
+    """
+    Keeps a kettle at the settings declared through update().
+
+    Args:
+        acquire: Returns an async context manager yielding a connected
+            StaggEKGPro with exclusive use of the link, e.g. a
+            KettleManager's get_kettle().
+        hub: Notification hub the kettle publishes to; watched for drift
+            once start() is called.
+        peek: Returns the cached state when it can be trusted without
+            acquiring the kettle (or None), so no-op changes don't queue
+            for the link at all.
+        debounce: Seconds a change waits for further changes to merge with.
+        hold_for: Seconds an applied field is still enforced: drift seen
+            in that window is written back, after it the kettle (e.g. its
+            own buttons) owns the field again.
+    """
+
+    def __init__(self, acquire: Callable[[], AsyncContextManager[StaggEKGPro]],
+                 hub: Optional[NotificationHub] = None,
+                 peek: Optional[Callable[[], Optional[KettleState]]] = None,
+                 debounce: float = 0.05, hold_for: float = 10.0):
+        self._acquire = acquire
+        self.hub = hub
+        self._peek = peek
+        self.debounce = debounce
+        self.hold_for = hold_for
+        self.requested = 0
+        self.coalesced = 0
+        self.writes = 0
+        self.elided = 0
+        self.reapplied = 0
+        self._pending: dict = {}
+        self._drifted: set[str] = set()   # Pending fields that are re-applications
+        self._applied: dict[str, tuple] = {}  # field -> (value, enforced until)
+        self._next: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        self._applying = False
+
+    @classmethod
+    def for_kettle(cls, kettle: StaggEKGPro, **kwargs) -> 'StateReconciler':
+        """Reconciler for a kettle used by nothing else."""
+        lock = asyncio.Lock()
+
+        @asynccontextmanager
+        async def acquire():
+            async with lock:
+                yield kettle
+
+        def peek() -> Optional[KettleState]:
+            age = kettle.state_age
+            if (not lock.locked() and kettle.client and kettle.client.is_connected
+                    and age is not None and age <= kettle.max_staleness):
+                return kettle.state
+            return None
+
+        kwargs.setdefault('peek', peek)
+        return cls(acquire, hub=kettle.hub, **kwargs)
+
+    async def update(self, **fields) -> Optional[KettleState]:
+        """
+        Declare desired values for some fields and wait until the kettle
+        has them. Returns the kettle's state afterwards.
+
+        Raises:
+            ValueError: An unknown field or an invalid value.
+        """
+        unknown = set(fields) - FIELDS
+        if unknown:
+            raise ValueError(f"Unknown kettle fields: {', '.join(sorted(unknown))}")
+        if 'schedule' in fields:
+            fields['schedule'] = Schedule(*fields['schedule'])
+        stage(KettleTransaction(bytearray(17)), fields)  # Reject bad values now, not in the flush
+
+        self.requested += 1
+        if not self._pending and (self._task is None or self._task.done()):
+            # Nothing queued that could change these fields: a no-op needs no debounce
+            state = self._peek() if self._peek else None
+            if state is not None and not needs_write(state.raw, fields):
+                self.elided += 1
+                self._enforce(fields)
+                return state
+
+        self._pending.update(fields)
+        self._drifted -= fields.keys()
+        return await asyncio.shield(self._schedule())
+
+    def _schedule(self) -> asyncio.Future:
+        """The future of the next flush, starting the flush task if needed."""
+        if self._next is None:
+            self._next = asyncio.get_running_loop().create_future()
+            self._next.add_done_callback(_retrieve)
+        elif not self._next.done():
+            self.coalesced += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return self._next
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(self.debounce)
+            desired, self._pending = self._pending, {}
+            drifted, self._drifted = self._drifted, set()
+            future, self._next = self._next, None
+            try:
+                state = await self._apply(desired, drifted)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(state)
+
+    async def _apply(self, desired: dict, drifted: set[str]) -> Optional[KettleState]:
+        state = self._peek() if self._peek else None
+        if state is not None and not needs_write(state.raw, desired):
+            self.elided += 1
+        else:
+            self._applying = True
+            try:
+                async with self._acquire() as kettle:
+                    async with kettle.transaction() as t:
+                        stage(t, desired)
+                    state = kettle.state
+            finally:
+                self._applying = False
+            if t.changed:
+                self.writes += 1
+            else:
+                self.elided += 1
+
+        self._enforce({f: v for f, v in desired.items() if f not in drifted})
+        return state
+
+    def _enforce(self, fields: dict):
+        """Watch applied fields for drift for the next ``hold_for`` seconds."""
+        until = time.monotonic() + self.hold_for
+        for field, value in fields.items():
+            self._applied[field] = (value, until)
+
+    def start(self):
+        """Start watching notifications for drift."""
+        if self.hub is not None and (self._watch_task is None or self._watch_task.done()):
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def close(self):
+        """Stop watching for drift and wait for a pending flush."""
+        if self._watch_task:
+            self._watch_task.cancel()
+            self._watch_task = None
+        if self._task and not self._task.done():
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _watch(self):
+        async with self.hub.subscribe(policy=OverflowPolicy.COALESCE) as updates:
+            async for change in updates:
+                if self._applying:
+                    continue  # Our own writes, including the first step of a schedule change
+                state = (self._peek() if self._peek else None) or change.state
+                self._check_drift(state)
+
+    def _check_drift(self, state: KettleState):
+        now = time.monotonic()
+        self._applied = {f: entry for f, entry in self._applied.items() if entry[1] > now}
+        drifted = {f: value for f, (value, _) in self._applied.items()
+                   if f not in self._pending and needs_write(state.raw, {f: value})}
+        if drifted:
+            self.reapplied += 1
+            self._pending.update(drifted)
+            self._drifted |= drifted.keys()
+            self._schedule()
+
+    def stats(self) -> dict:
+        return {
+            "requested": self.requested,
+            "coalesced": self.coalesced,
+            "writes": self.writes,
+            "elided": self.elided,
+            "reapplied": self.reapplied,
+            "enforced": sorted(f for f, (_, until) in self._applied.items() if until > time.monotonic()),
+        }
+
+def _retrieve(future: asyncio.Future):
+    # Drift re-applications have no caller, so their errors are retrieved here
+    if not future.cancelled():
+        future.exception()
@@ -33,8 +33,10 @@ document.addEventListener('DOMContentLoaded', () => {
     if (els.refreshBtn) els.refreshBtn.addEventListener('click', fetchState);
 
     if (els.tempSlider) {
-        els.tempSlider.addEventListener('input', (e) => updateTempDisplay(e.target.value));
-        els.tempSlider.addEventListener('change', (e) => setTemperature(e.target.value));
+        els.tempSlider.addEventListener('input', (e) => {
+            updateTempDisplay(e.target.value);
+            setTemperature(e.target.value);
+        });
     }
     
     if (els.schedTemp && els.schedTempDisplay) {
@@ -187,15 +189,36 @@ async function fetchState() {
     }
 }
 
+// The slider sends its value while it moves, one request at a time: values
+// picked while a request is in flight collapse into the latest one, and the
+// server merges quick changes and skips the ones the kettle already has.
+let tempInFlight = false;
+let tempQueued = null;
+
 async function setTemperature(val) {
+    if (tempInFlight) {
+        tempQueued = val;
+        return;
+    }
+    tempInFlight = true;
     try {
         await fetch('/api/temperature', {
             method: 'POST',
             headers: {'Content-Type': 'application/json'},
             body: JSON.stringify({temperature: parseFloat(val)})
         });
-        fetchState();
-    } catch (e) { alert(e); }
+    } catch (e) {
+        tempQueued = null;
+        alert(e);
+    } finally {
+        tempInFlight = false;
+    }
+    if (tempQueued !== null) {
+        const next = tempQueued;
+        tempQueued = null;
+        return setTemperature(next);
+    }
+    fetchState();
 }
 
 async function setHold() {
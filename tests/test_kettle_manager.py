@@ -0,0 +1,69 @@
+"""
+KettleManager against kettle_sim: a kettle the manager lets go of must not
+keep reconnecting on its own.
+
+    python -m pytest tests
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("KETTLE_DB_PATH", os.path.join(tempfile.mkdtemp(), "kettle_oauth.db"))
+
+from connection_policy import KeepAlivePolicy
+from kettle_server import KettleManager
+from kettle_sim import KettleSimulator, LinkProfile
+
+NAME, ADDRESS = "EKG-a8-41-f0", "A8:41:F0:00:00:01"
+
+def _manager(sim: KettleSimulator, idle: float = 60.0) -> KettleManager:
+    return KettleManager(
+        NAME, scanner=sim.scanner, client_factory=sim.client,
+        policy=KeepAlivePolicy(min_idle=idle, max_idle=idle),
+    )
+
+async def _drop_link(sim: KettleSimulator, manager: KettleManager):
+    """Lose the link while the kettle is out of range, leaving a background reconnect running."""
+    async with manager.get_kettle() as kettle:
+        pass
+    sim.kettles[ADDRESS].advertising = False
+    kettle.client._lose_link()
+    await asyncio.sleep(0)
+    assert kettle.reconnecting
+    return kettle
+
+def test_idle_timeout_stops_reconnect_of_dropped_link():
+    async def run():
+        sim = KettleSimulator(LinkProfile(connect_latency=0.05, scan_latency=0.05, jitter=0))
+        sim.add_kettle(NAME, ADDRESS)
+        async with sim:
+            manager = _manager(sim, idle=0.2)
+            kettle = await _drop_link(sim, manager)
+            await asyncio.sleep(0.5)  # Past the idle timeout
+            assert manager.kettle is None
+            assert not kettle.reconnecting
+
+            sim.kettles[ADDRESS].advertising = True
+            await asyncio.sleep(2.0)  # Longer than the reconnect backoff
+            assert not kettle.is_ready
+            assert not kettle.client.is_connected
+            await manager.close()
+    asyncio.run(run())
+
+def test_close_stops_reconnect_of_dropped_link():
+    async def run():
+        sim = KettleSimulator(LinkProfile(connect_latency=0.05, scan_latency=0.05, jitter=0))
+        sim.add_kettle(NAME, ADDRESS)
+        async with sim:
+            manager = _manager(sim)
+            kettle = await _drop_link(sim, manager)
+            await manager.close()
+            assert not kettle.reconnecting
+
+            sim.kettles[ADDRESS].advertising = True
+            await asyncio.sleep(2.0)
+            assert not kettle.client.is_connected
+    asyncio.run(run())
@@ -0,0 +1,79 @@
+"""
+In-memory cache of validated OAuth access tokens.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Optional
+
+class TokenCache:
+    """
+    Bounded LRU cache mapping access tokens to user ids, so validating the
+    bearer token of a request doesn't need a database lookup.
+
+    An entry is kept for at most ``ttl`` seconds and never past the token's
+    own expiry; when ``maxsize`` tokens are cached, the least recently used
+    one is evicted. Only valid tokens are cached, so unknown tokens can't
+    flood it.
+
+    ``generation`` changes on every invalidation. A lookup that reads the
+    database concurrently with a revocation passes the generation it saw
+    before reading to put(), which then doesn't cache a stale result.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()  # token -> (user_id, valid_until)
+
+    def get(self, access_token: str, now: Optional[float] = None) -> Optional[str]:
+        """User id of a cached, still valid token, or None."""
+        entry = self._entries.get(access_token)
+        if entry is not None:
+            user_id, valid_until = entry
+            if valid_until > (time.time() if now is None else now):
+                self._entries.move_to_end(access_token)
+                self.hits += 1
+                return user_id
+            del self._entries[access_token]
+        self.misses += 1
+        return None
+
+    def put(self, access_token: str, user_id: str, expires_at: float, now: Optional[float] = None,
+            generation: Optional[int] = None):
+        """Cache a token that was just validated; ``expires_at`` is its expiry (epoch seconds)."""
+        if generation is not None and generation != self.generation:
+            return
+        now = time.time() if now is None else now
+        self._entries[access_token] = (user_id, min(expires_at, now + self.ttl))
+        self._entries.move_to_end(access_token)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, access_token: str):
+        self.generation += 1
+        self._entries.pop(access_token, None)
+
+    def invalidate_user(self, user_id: str):
+        self.generation += 1
+        for token in [t for t, (uid, _) in self._entries.items() if uid == user_id]:
+            del self._entries[token]
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+            "evictions": self.evictions,
+        }